@@ -0,0 +1,217 @@
+"""
+Benchmark harness for the verification flow.
+
+Times each stage of challenge generation, grid rendering and validation per level and
+per image format, and writes p50/p95/p99 latencies as JSON. Runs headless: the PhotoImage
+stage uses a hidden Tk root when a display is available (e.g. under Xvfb) and is skipped
+otherwise (--no-tk forces that). Pass --baseline to fail on p95 regressions.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from challenge_engine import ChallengeEngine
+from image_cache import ThumbnailCache, thumbnail_dimension
+from image_catalog import CAMPUS, EXTERNAL, ImageCatalog
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(samples):
+    """Latency summary in milliseconds for a list of durations in seconds"""
+    values = sorted(s * 1000 for s in samples)
+    return {
+        "count": len(values),
+        "mean_ms": sum(values) / len(values) if values else None,
+        "p50_ms": percentile(values, 50),
+        "p95_ms": percentile(values, 95),
+        "p99_ms": percentile(values, 99),
+        "max_ms": values[-1] if values else None,
+    }
+
+
+class StageTimer:
+    """Collects duration samples per (stage, key)"""
+
+    def __init__(self):
+        self.samples = defaultdict(lambda: defaultdict(list))
+
+    def add(self, stage, key, seconds):
+        self.samples[stage][str(key)].append(seconds)
+
+    def results(self):
+        return {stage: {key: summarize(values) for key, values in sorted(keys.items())}
+                for stage, keys in sorted(self.samples.items())}
+
+
+def _make_photo_factory(use_tk):
+    """Return a PhotoImage constructor bound to a hidden Tk root, or None when unavailable"""
+    if not use_tk:
+        return None, None
+    try:
+        import tkinter as tk
+        from PIL import ImageTk
+        root = tk.Tk()
+        root.withdraw()
+    except Exception as e:
+        print(f"Tk unavailable, skipping the PhotoImage stage: {e}", file=sys.stderr)
+        return None, None
+    return ImageTk.PhotoImage, root
+
+
+def bench_images(catalog, timer, iterations, photo_factory, cache_dir):
+    """Time open/decode, resize, thumbnail load and PhotoImage per format and cell size"""
+    from PIL import Image
+
+    thumbnails = ThumbnailCache(cache_dir)
+    cell_sizes = ChallengeEngine(catalog).cell_sizes
+    for record in catalog.records.values():
+        for _ in range(iterations):
+            try:
+                start = time.perf_counter()
+                src = Image.open(record.path)
+                src.load()
+                timer.add("decode_source", record.format, time.perf_counter() - start)
+            except Exception as e:
+                print(f"Error decoding {record.path}: {e}", file=sys.stderr)
+                break
+
+            for cell_size in cell_sizes:
+                dim = thumbnail_dimension(cell_size)
+                start = time.perf_counter()
+                src.resize((dim, dim), Image.LANCZOS)
+                timer.add("resize", f"{record.format}@{cell_size}", time.perf_counter() - start)
+
+                thumb_path = thumbnails.get(record.path, cell_size)
+                start = time.perf_counter()
+                tile = Image.open(thumb_path)
+                tile.load()
+                timer.add("thumbnail_load", cell_size, time.perf_counter() - start)
+
+                if photo_factory is not None:
+                    start = time.perf_counter()
+                    photo_factory(tile)
+                    timer.add("photo_image", cell_size, time.perf_counter() - start)
+
+
+def bench_levels(catalog, timer, iterations, photo_factory, cache_dir, seed):
+    """Time challenge generation, grid rendering, selection toggles and validation per level"""
+    from PIL import Image
+
+    engine = ChallengeEngine(catalog, rng=random.Random(seed))
+    thumbnails = ThumbnailCache(cache_dir)
+    for level, rule in sorted(engine.levels.items()):
+        if not engine.can_generate(level):
+            continue
+        for _ in range(iterations):
+            start = time.perf_counter()
+            challenge = engine.new_challenge(level)
+            timer.add("load_level", level, time.perf_counter() - start)
+
+            # Grid render: load every pre-sized tile (and build its PhotoImage when Tk is up)
+            start = time.perf_counter()
+            for image_id in challenge.image_ids:
+                tile = Image.open(thumbnails.get(catalog.path(image_id), rule.cell_size))
+                tile.load()
+                if photo_factory is not None:
+                    photo_factory(tile)
+            timer.add("display_image_grid", level, time.perf_counter() - start)
+
+            for image_id in challenge.image_ids:
+                start = time.perf_counter()
+                challenge.toggle(image_id)
+                timer.add("toggle_selection", level, time.perf_counter() - start)
+
+            start = time.perf_counter()
+            engine.validate(challenge)
+            timer.add("validate_selection", level, time.perf_counter() - start)
+
+
+def compare(results, baseline, tolerance):
+    """Return the stages whose p95 got slower than baseline by more than tolerance"""
+    regressions = []
+    for stage, keys in results["stages"].items():
+        for key, stats in keys.items():
+            old = baseline.get("stages", {}).get(stage, {}).get(key)
+            if not old or old.get("p95_ms") is None or stats["p95_ms"] is None:
+                continue
+            if stats["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+                regressions.append(f"{stage}[{key}]: p95 {old['p95_ms']:.3f} -> {stats['p95_ms']:.3f} ms")
+    return regressions
+
+
+def run(campus_dir, external_dir, iterations=20, use_tk=True, seed=0, cache_dir=None):
+    """Run every benchmark and return the results as a dict"""
+    import PIL
+
+    catalog = ImageCatalog({CAMPUS: campus_dir, EXTERNAL: external_dir}, manifest_path=None)
+    photo_factory, root = _make_photo_factory(use_tk)
+    timer = StageTimer()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # A fresh thumbnail cache keeps runs comparable
+        cache_dir = cache_dir or tmp_dir
+        bench_images(catalog, timer, max(1, iterations // 4), photo_factory, cache_dir)
+        bench_levels(catalog, timer, iterations, photo_factory, cache_dir, seed)
+    if root is not None:
+        root.destroy()
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "platform": platform.platform(),
+            "tk": photo_factory is not None,
+            "iterations": iterations,
+            "images": len(catalog),
+        },
+        "stages": timer.results(),
+    }
+
+
+def main():
+    """Run the benchmark from the command line"""
+    parser = argparse.ArgumentParser(description="Benchmark the verification flow")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--no-tk", action="store_true", help="skip the PhotoImage stage")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--campus-dir", default=os.path.join(BASE_DIR, "campus_images"))
+    parser.add_argument("--external-dir", default=os.path.join(BASE_DIR, "external_images"))
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    parser.add_argument("--baseline", help="earlier results to compare p95 latencies against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed p95 slowdown vs the baseline (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    results = run(args.campus_dir, args.external_dir, args.iterations, not args.no_tk, args.seed)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"Regression: {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
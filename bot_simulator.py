@@ -0,0 +1,280 @@
+"""
+Monte Carlo bot-attack simulator for the campus verification levels.
+
+Runs large numbers of simulated verification attempts (level 1 -> 2 -> 3, restarting at
+level 1 after any failure, like the kiosk) against the level rules of the challenge
+engine. Trials are vectorized with NumPy, run in batches and spread over a process pool.
+
+Strategies:
+  random_clicker   clicks a random number of distinct cells
+  required_count   always selects exactly as many cells as the level requires
+  learner          remembers images whose label it has worked out from earlier attempts
+                   (a pass reveals the whole grid, a failed single pick reveals an
+                   external image) and uses that knowledge on repeated images
+"""
+import argparse
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from challenge_engine import DEFAULT_LEVELS, DEFAULT_LEVELS_PATH, load_levels
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+STRATEGIES = ("random_clicker", "required_count", "learner")
+
+# Number of slices the learner's attempts are split into for its learning curve
+LEARNING_CURVE_POINTS = 10
+
+
+def level_specs(levels):
+    """Turn LevelRules into picklable (level, cells, campus_count, single_select) tuples"""
+    return [(rule.level, rule.total_cells, rule.campus_count, rule.single_select) for rule in levels]
+
+
+def analytic_pass_rate(strategy, cells, campus_count, single_select):
+    """Closed-form pass probability of one level, or None when there is no closed form"""
+    if strategy == "required_count":
+        # Only one of the C(n, k) k-subsets is the campus set
+        return 1 / math.comb(cells, campus_count)
+    if strategy == "random_clicker":
+        if single_select:
+            # Only the last click counts
+            return campus_count / cells
+        # The click count has to be k (1 in n), then the subset has to be right
+        return 1 / (cells * math.comb(cells, campus_count))
+    return None
+
+
+def wilson_interval(successes, trials, z=1.96):
+    """95% Wilson score interval for a binomial proportion"""
+    if trials == 0:
+        return (0.0, 1.0)
+    p = successes / trials
+    denom = 1 + z * z / trials
+    centre = (p + z * z / (2 * trials)) / denom
+    half = z * math.sqrt(p * (1 - p) / trials + z * z / (4 * trials * trials)) / denom
+    return (max(0.0, centre - half), min(1.0, centre + half))
+
+
+def _subset_masks(rng, rows, cells, sizes):
+    """
+    Bitmasks (bit i = cell i) of uniformly random cell subsets.
+    sizes is the subset size, either one int or one per row.
+    """
+    # A random permutation per row doubles as a random rank for every cell
+    ranks = rng.permuted(np.tile(np.arange(cells), (rows, 1)), axis=1)
+    chosen = ranks < np.reshape(sizes, (-1, 1))
+    bits = np.left_shift(np.uint64(1), np.arange(cells, dtype=np.uint64))
+    return (chosen * bits).sum(axis=1, dtype=np.uint64)
+
+
+def _select_blind(rng, strategy, rows, cells, campus_count, single_select):
+    """Selection masks of a strategy that ignores the grid contents"""
+    if strategy == "required_count":
+        sizes = campus_count
+    elif single_select:
+        # Clicking a new cell replaces the previous pick, so one cell stays selected
+        sizes = 1
+    else:
+        sizes = rng.integers(1, cells + 1, size=rows)
+    return _subset_masks(rng, rows, cells, sizes)
+
+
+def _run_blind(rng, strategy, specs, trials):
+    """Simulate trials attempts of a non-learning strategy; returns (reached, passed)"""
+    reached = []
+    passed = []
+    active = trials
+    for _, cells, campus_count, single_select in specs:
+        reached.append(active)
+        if active == 0:
+            passed.append(0)
+            continue
+        # Grid: the campus images land on random cells
+        campus_mask = _subset_masks(rng, active, cells, campus_count)
+        selected_mask = _select_blind(rng, strategy, active, cells, campus_count, single_select)
+        # Same rule as ChallengeEngine.validate_mask: the selection must be exactly the campus cells
+        active = int(np.count_nonzero(selected_mask == campus_mask))
+        passed.append(active)
+    return reached, passed
+
+
+def _run_learner(rng, specs, pool_sizes, attackers, attempts):
+    """Simulate attackers that learn image labels over attempts sequential attempts each"""
+    campus_pool, external_pool = pool_sizes
+    known_campus = np.zeros((attackers, campus_pool), dtype=bool)
+    known_external = np.zeros((attackers, external_pool), dtype=bool)
+
+    reached = [0] * len(specs)
+    passed = [0] * len(specs)
+    curve_passes = [0] * LEARNING_CURVE_POINTS
+    curve_trials = [0] * LEARNING_CURVE_POINTS
+
+    for attempt in range(attempts):
+        alive = np.arange(attackers)
+        for i, (_, cells, campus_count, _) in enumerate(specs):
+            reached[i] += len(alive)
+            if len(alive) == 0:
+                continue
+            rows = len(alive)
+            external_count = cells - campus_count
+
+            # Draw the grid's images from the pools (without replacement within a grid)
+            campus_idx = np.argsort(rng.random((rows, campus_pool)), axis=1)[:, :campus_count]
+            external_idx = np.argsort(rng.random((rows, external_pool)), axis=1)[:, :external_count]
+            kc = known_campus[alive[:, None], campus_idx]
+            ke = known_external[alive[:, None], external_idx]
+
+            # Known campus images are always picked and known externals never; the rest of
+            # the required count is filled with the lowest random keys among unknown cells
+            unknown_campus = campus_count - kc.sum(axis=1)
+            campus_keys = np.where(kc, -np.inf, rng.random((rows, campus_count)))
+            external_keys = np.where(ke, np.inf, rng.random((rows, external_count)))
+            worst_campus = campus_keys.max(axis=1, initial=-np.inf)
+            best_external = external_keys.min(axis=1, initial=np.inf)
+            ok = (unknown_campus == 0) | (worst_campus < best_external)
+
+            # A pass reveals the label of every image in the grid
+            won = alive[ok]
+            known_campus[won[:, None], campus_idx[ok]] = True
+            known_external[won[:, None], external_idx[ok]] = True
+
+            # A failed single unknown pick reveals that the picked image is external
+            single = ~ok & (unknown_campus == 1)
+            if single.any():
+                picked = external_idx[single, external_keys[single].argmin(axis=1)]
+                known_external[alive[single], picked] = True
+
+            alive = won
+            passed[i] += len(alive)
+
+        point = attempt * LEARNING_CURVE_POINTS // attempts
+        curve_trials[point] += attackers
+        curve_passes[point] += len(alive)
+
+    return reached, passed, curve_passes, curve_trials
+
+
+def run_batch(strategy, specs, pool_sizes, trials, attempts_per_attacker, seed):
+    """Run one batch of trials in a worker process and return its counts"""
+    rng = np.random.default_rng(seed)
+    if strategy == "learner":
+        attackers = max(1, trials // attempts_per_attacker)
+        reached, passed, curve_passes, curve_trials = _run_learner(
+            rng, specs, pool_sizes, attackers, attempts_per_attacker)
+    else:
+        reached, passed = _run_blind(rng, strategy, specs, trials)
+        curve_passes, curve_trials = [], []
+    return {"reached": reached, "passed": passed,
+            "curve_passes": curve_passes, "curve_trials": curve_trials}
+
+
+def simulate(strategy, trials, levels=DEFAULT_LEVELS, pool_sizes=(35, 15),
+             batch_size=200_000, attempts_per_attacker=200, workers=None, seed=None):
+    """
+    Simulate trials verification attempts and return per-level and overall pass rates.
+    pool_sizes is (campus images, external images) and only matters for the learner.
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown strategy {strategy!r}")
+    specs = level_specs(levels)
+    batches = [min(batch_size, trials - start) for start in range(0, trials, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(batches))
+
+    reached = [0] * len(specs)
+    passed = [0] * len(specs)
+    curve_passes = [0] * LEARNING_CURVE_POINTS
+    curve_trials = [0] * LEARNING_CURVE_POINTS
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_batch, strategy, specs, pool_sizes, size, attempts_per_attacker, s)
+                   for size, s in zip(batches, seeds)]
+        for future in futures:
+            counts = future.result()
+            for i in range(len(specs)):
+                reached[i] += counts["reached"][i]
+                passed[i] += counts["passed"][i]
+            for i, value in enumerate(counts["curve_passes"]):
+                curve_passes[i] += value
+                curve_trials[i] += counts["curve_trials"][i]
+
+    attempts = reached[0]
+    report = {"strategy": strategy, "attempts": attempts, "levels": []}
+    analytic_overall = 1.0
+    for (level, cells, campus_count, single_select), r, p in zip(specs, reached, passed):
+        analytic = analytic_pass_rate(strategy, cells, campus_count, single_select)
+        analytic_overall = None if analytic is None or analytic_overall is None else analytic_overall * analytic
+        report["levels"].append({
+            "level": level,
+            "reached": r,
+            "passed": p,
+            "pass_rate": p / r if r else 0.0,
+            "ci95": wilson_interval(p, r),
+            "analytic": analytic,
+        })
+
+    overall = passed[-1]
+    report["overall"] = {
+        "passed": overall,
+        "pass_rate": overall / attempts if attempts else 0.0,
+        "ci95": wilson_interval(overall, attempts),
+        "analytic": analytic_overall,
+    }
+    if strategy == "learner":
+        report["learning_curve"] = [p / t if t else 0.0 for p, t in zip(curve_passes, curve_trials)]
+    return report
+
+
+def print_report(report):
+    """Print a simulation report next to the analytic values"""
+    print(f"Strategy: {report['strategy']}  ({report['attempts']:,} attempts)")
+    for entry in report["levels"] + [dict(report["overall"], level="all")]:
+        low, high = entry["ci95"]
+        analytic = "n/a" if entry["analytic"] is None else f"{entry['analytic']:.3e}"
+        print(f"Level {entry['level']}: pass rate {entry['pass_rate']:.3e}  "
+              f"95% CI [{low:.3e}, {high:.3e}]  analytic {analytic}")
+    if "learning_curve" in report:
+        curve = ", ".join(f"{rate:.2e}" for rate in report["learning_curve"])
+        print(f"Overall pass rate by tenth of attempts: {curve}")
+
+
+def main():
+    """Run the simulator from the command line"""
+    parser = argparse.ArgumentParser(description="Monte Carlo bot-attack simulator")
+    parser.add_argument("--strategy", choices=STRATEGIES + ("all",), default="all")
+    parser.add_argument("--trials", type=int, default=1_000_000)
+    parser.add_argument("--batch-size", type=int, default=200_000)
+    parser.add_argument("--attempts-per-attacker", type=int, default=200,
+                        help="sequential attempts by each learning attacker")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--campus-dir", default=os.path.join(BASE_DIR, "campus_images"))
+    parser.add_argument("--external-dir", default=os.path.join(BASE_DIR, "external_images"))
+    parser.add_argument("--levels", default=DEFAULT_LEVELS_PATH, help="level definitions (JSON)")
+    parser.add_argument("--json", help="also write the reports to this file")
+    args = parser.parse_args()
+
+    from image_catalog import CAMPUS, EXTERNAL, ImageCatalog
+    catalog = ImageCatalog({CAMPUS: args.campus_dir, EXTERNAL: args.external_dir})
+    pool_sizes = (len(catalog.campus_ids), len(catalog.external_ids))
+    levels = load_levels(args.levels)
+
+    strategies = STRATEGIES if args.strategy == "all" else (args.strategy,)
+    reports = []
+    for strategy in strategies:
+        report = simulate(strategy, args.trials, levels, pool_sizes=pool_sizes, batch_size=args.batch_size,
+                          attempts_per_attacker=args.attempts_per_attacker,
+                          workers=args.workers, seed=args.seed)
+        print_report(report)
+        reports.append(report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
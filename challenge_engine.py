@@ -0,0 +1,322 @@
+"""
+Headless challenge engine for the campus verification system.
+Holds the level rules, image sampling, selection tracking, timing and scoring with no
+GUI imports, so it can back the Tk kiosk as well as a server or a load test.
+Level rules are read from levels.json (see load_levels).
+"""
+import json
+import os
+import random
+import time
+
+from image_catalog import CAMPUS, EXTERNAL
+
+
+class LevelRule:
+    """Rules for a single verification level"""
+
+    __slots__ = ("level", "rows", "cols", "campus_count", "external_count", "time_limit", "cell_size",
+                 "points_per_correct")
+
+    def __init__(self, level, rows, cols, campus_count, external_count, time_limit, cell_size,
+                 points_per_correct=5):
+        self.level = level
+        self.rows = rows
+        self.cols = cols
+        self.campus_count = campus_count
+        self.external_count = external_count
+        self.time_limit = time_limit  # seconds
+        self.cell_size = cell_size  # pixels
+        self.points_per_correct = points_per_correct
+
+    def __repr__(self):
+        return (f"LevelRule(level={self.level}, grid={self.rows}x{self.cols}, "
+                f"campus_count={self.campus_count}, time_limit={self.time_limit})")
+
+    @property
+    def key(self):
+        """Everything that shapes a generated challenge, for pooling challenges per level spec"""
+        return (self.level, self.rows, self.cols, self.campus_count, self.external_count, self.cell_size)
+
+    @property
+    def total_cells(self):
+        return self.rows * self.cols
+
+    @property
+    def required_selection_count(self):
+        # Every campus image in the grid has to be selected
+        return self.campus_count
+
+    @property
+    def single_select(self):
+        # With only one campus image, picking a tile replaces the previous pick
+        return self.campus_count == 1
+
+
+# Built-in levels, used when no levels.json is present
+DEFAULT_LEVELS = (
+    LevelRule(1, 2, 2, 1, 3, 30, 220),    # Level 1: 2x2 grid, 1 campus image, 30 seconds
+    LevelRule(2, 3, 3, 3, 6, 60, 180),    # Level 2: 3x3 grid, 3 campus images, 1 minute
+    LevelRule(3, 4, 4, 6, 10, 120, 150),  # Level 3: 4x4 grid, 6 campus images, 2 minutes
+)
+
+# Default location of the level definitions, next to this module
+DEFAULT_LEVELS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "levels.json")
+
+
+def load_levels(path=DEFAULT_LEVELS_PATH):
+    """
+    Read level rules from a JSON file of the form {"levels": [{...}, ...]}.
+    Each level has rows, cols, campus_count, time_limit (seconds) and cell_size (pixels),
+    plus optional external_count (defaults to the remaining cells) and points_per_correct.
+    Levels are numbered 1..N in file order. Returns DEFAULT_LEVELS when the file is missing.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return DEFAULT_LEVELS
+
+    levels = []
+    for number, spec in enumerate(data["levels"], start=1):
+        try:
+            rows = int(spec["rows"])
+            cols = int(spec["cols"])
+            campus_count = int(spec["campus_count"])
+            external_count = int(spec.get("external_count", rows * cols - campus_count))
+            rule = LevelRule(number, rows, cols, campus_count, external_count,
+                             int(spec["time_limit"]), int(spec["cell_size"]),
+                             int(spec.get("points_per_correct", 5)))
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"{path}: level {number} is invalid: {e!r}")
+        if rows < 1 or cols < 1:
+            raise ValueError(f"{path}: level {number} needs rows >= 1 and cols >= 1")
+        if rule.time_limit < 1:
+            raise ValueError(f"{path}: level {number} needs time_limit >= 1")
+        if rule.cell_size <= 4:
+            # Thumbnails are the cell minus its 2px border on each side
+            raise ValueError(f"{path}: level {number} needs cell_size > 4")
+        if campus_count < 1 or external_count < 0 or campus_count + external_count != rule.total_cells:
+            raise ValueError(f"{path}: level {number} needs campus_count + external_count == rows * cols")
+        levels.append(rule)
+    if not levels:
+        raise ValueError(f"{path}: no levels defined")
+    return tuple(levels)
+
+
+def cell_sizes(levels):
+    """Return the distinct cell sizes used by a sequence of level rules"""
+    return tuple(sorted({rule.cell_size for rule in levels}))
+
+
+class NotEnoughImagesError(Exception):
+    """Raised when the catalog cannot fill a level's grid"""
+
+
+class Challenge:
+    """One grid of images shown to a user, with the user's current selection"""
+
+    __slots__ = ("rule", "image_ids", "campus_ids", "selected", "deadline")
+
+    def __init__(self, rule, image_ids, campus_ids):
+        self.rule = rule
+        self.image_ids = tuple(image_ids)
+        self.campus_ids = frozenset(campus_ids)  # Campus images in this grid
+        self.selected = set()
+        self.deadline = None  # time.monotonic() value, set by start()
+
+    @property
+    def level(self):
+        return self.rule.level
+
+    @property
+    def campus_mask(self):
+        """Bitmask of the grid cells holding campus images (bit i = cell i)"""
+        mask = 0
+        for cell, image_id in enumerate(self.image_ids):
+            if image_id in self.campus_ids:
+                mask |= 1 << cell
+        return mask
+
+    def start(self, now=None):
+        """Start the level clock (call once the grid is fully shown)"""
+        if now is None:
+            now = time.monotonic()
+        self.deadline = now + self.rule.time_limit
+
+    def time_remaining(self, now=None):
+        """Seconds left before the deadline (the full time limit if not started)"""
+        if self.deadline is None:
+            return float(self.rule.time_limit)
+        if now is None:
+            now = time.monotonic()
+        return max(0.0, self.deadline - now)
+
+    def is_expired(self, now=None):
+        """Check whether the deadline has passed"""
+        if self.deadline is None:
+            return False
+        if now is None:
+            now = time.monotonic()
+        return now >= self.deadline
+
+    def toggle(self, image_id):
+        """Toggle the selection of an image; returns True if it is now selected"""
+        if image_id in self.selected:
+            self.selected.discard(image_id)
+            return False
+        if self.rule.single_select:
+            self.selected.clear()
+        self.selected.add(image_id)
+        return True
+
+
+class ValidationResult:
+    """Outcome of checking a challenge's selection"""
+
+    __slots__ = ("passed", "expired", "campus_count", "incorrect", "points")
+
+    def __init__(self, passed, expired, campus_count, incorrect, points):
+        self.passed = passed
+        self.expired = expired
+        self.campus_count = campus_count  # Correctly selected campus images
+        self.incorrect = incorrect  # Selected images that are not campus images
+        self.points = points
+
+    def __repr__(self):
+        return (f"ValidationResult(passed={self.passed}, expired={self.expired}, "
+                f"campus_count={self.campus_count}, points={self.points})")
+
+
+class ChallengeEngine:
+    """Creates and verifies challenges from an ImageCatalog"""
+
+    def __init__(self, catalog, levels=None, rng=None, dedup=None):
+        """
+        Initialize the engine for a catalog and a sequence of level rules
+        (read from levels.json when not given).
+        dedup is an optional DuplicateIndex; with one, a grid never shows two images
+        from the same near-duplicate group.
+        """
+        if levels is None:
+            levels = load_levels()
+        self.catalog = catalog
+        self.dedup = dedup
+        self.levels = {rule.level: rule for rule in levels}
+        self.level_count = len(self.levels)
+        self.cell_sizes = cell_sizes(levels)
+        self.rng = rng or random.Random()
+
+    def rule(self, level):
+        """Get the rules for a level"""
+        return self.levels[level]
+
+    def required_selection_count(self, level):
+        """Get the required number of selections for a level"""
+        return self.levels[level].required_selection_count
+
+    def can_generate(self, level):
+        """Check whether the catalog has enough images for a level"""
+        rule = self.levels[level]
+        if self.dedup is not None:
+            # Groups are shared across labels: a group with campus and external members
+            # can fill a cell of either label, but only one cell of the grid
+            campus_only, external_only, shared = self.dedup.label_group_counts()
+            return (rule.campus_count <= campus_only + shared and
+                    rule.external_count <= external_only + shared and
+                    rule.campus_count + rule.external_count <= campus_only + external_only + shared)
+        return (len(self.catalog.campus_ids) >= rule.campus_count and
+                len(self.catalog.external_ids) >= rule.external_count)
+
+    def sample_images(self, level, ids_by_label=None):
+        """Randomly pick a shuffled set of campus + external image IDs for a level"""
+        rule = self.levels[level]
+        if ids_by_label is None:
+            ids_by_label = self.catalog.ids_by_label
+        campus_ids = ids_by_label.get(CAMPUS, ())
+        external_ids = ids_by_label.get(EXTERNAL, ())
+        if len(campus_ids) < rule.campus_count or len(external_ids) < rule.external_count:
+            raise NotEnoughImagesError(f"Not enough images for level {level}")
+
+        if self.dedup is None:
+            images = (self.rng.sample(campus_ids, rule.campus_count) +
+                      self.rng.sample(external_ids, rule.external_count))
+        else:
+            # Groups are shared across labels, so a campus picture copied into the
+            # external pool cannot show up next to itself either
+            groups = self.dedup.groups
+            used_groups = set()
+            images = (self._sample_distinct(campus_ids, rule.campus_count, groups, used_groups) +
+                      self._sample_distinct(external_ids, rule.external_count, groups, used_groups))
+        self.rng.shuffle(images)
+        return images
+
+    def _sample_distinct(self, image_ids, count, groups, used_groups):
+        """Pick count image IDs whose near-duplicate groups are not in used_groups yet"""
+        picked = []
+        # Rejection sampling is O(count) while most groups are single images
+        for _ in range(4 * count):
+            if len(picked) == count:
+                return picked
+            image_id = self.rng.choice(image_ids)
+            group = groups.get(image_id, image_id)
+            if group not in used_groups:
+                used_groups.add(group)
+                picked.append(image_id)
+
+        # The pool is crowded with duplicates: scan it in random order instead
+        remaining = list(image_ids)
+        self.rng.shuffle(remaining)
+        for image_id in remaining:
+            if len(picked) == count:
+                break
+            group = groups.get(image_id, image_id)
+            if group not in used_groups:
+                used_groups.add(group)
+                picked.append(image_id)
+        if len(picked) < count:
+            raise NotEnoughImagesError(f"Not enough distinct images: need {count}, found {len(picked)}")
+        return picked
+
+    def new_challenge(self, level, image_ids=None):
+        """Create a challenge for a level, sampling images unless image_ids is given"""
+        rule = self.levels[level]
+        records, ids_by_label = self.catalog.snapshot()
+        if image_ids is None:
+            image_ids = self.sample_images(level, ids_by_label)
+
+        campus_ids = [image_id for image_id in image_ids if records[image_id].is_campus]
+        return Challenge(rule, image_ids, campus_ids)
+
+    def validate(self, challenge, selected=None, now=None):
+        """
+        Check a selection against a challenge.
+        selected defaults to the challenge's own tracked selection. A started challenge
+        whose deadline has passed always fails.
+        """
+        if selected is None:
+            selected = challenge.selected
+
+        campus_ids = challenge.campus_ids
+        incorrect = [image_id for image_id in selected if image_id not in campus_ids]
+        campus_count = len(selected) - len(incorrect)
+        expired = challenge.is_expired(now)
+
+        passed = (not expired and not incorrect and
+                  campus_count == challenge.rule.required_selection_count)
+        return ValidationResult(passed, expired, campus_count, incorrect,
+                                campus_count * challenge.rule.points_per_correct)
+
+    def validate_mask(self, level, campus_mask, selected_mask, expired=False):
+        """
+        Check a selection given as grid cell bitmasks (bit i = cell i).
+        ValidationResult.incorrect then holds cell indices instead of image IDs.
+        """
+        incorrect_mask = selected_mask & ~campus_mask
+        incorrect = [cell for cell in range(incorrect_mask.bit_length()) if incorrect_mask >> cell & 1]
+        campus_count = bin(selected_mask & campus_mask).count("1")
+
+        rule = self.levels[level]
+        passed = (not expired and not incorrect and campus_count == rule.required_selection_count)
+        return ValidationResult(passed, expired, campus_count, incorrect,
+                                campus_count * rule.points_per_correct)
@@ -0,0 +1,333 @@
+"""
+Challenge scheduling: which images go into the next grid, and when it is generated.
+
+Each label's images are dealt from a shuffled deck (a "shuffle bag"): every image is
+shown once before any image is shown twice, so rarely drawn images are not wasted and
+exposure stays balanced. Images the current session has seen recently, or that share a
+near-duplicate group with an image already in the grid, are passed over and put back at
+the front of the deck. Drawing k images therefore takes O(k) expected time.
+
+Every level keeps a pool of ready challenges that a worker thread refills. Issuing a
+challenge usually just pops one from the pool.
+"""
+import threading
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from challenge_engine import NotEnoughImagesError
+from image_catalog import CAMPUS, EXTERNAL
+
+# Ready challenges kept per level, and the level at which a refill starts
+DEFAULT_POOL_SIZE = 32
+DEFAULT_LOW_WATER = 8
+
+# How many recently shown images a session tries not to see again
+DEFAULT_RECENT_WINDOW = 24
+
+# Pooled challenges compared with the session history when one is issued
+POOL_SCAN_LIMIT = 8
+
+
+class ExposureHistory:
+    """The most recently shown images of one session (kiosk or client)"""
+
+    def __init__(self, window=DEFAULT_RECENT_WINDOW):
+        self.window = window
+        self._recent = deque()
+        # image ID -> sequence number of its latest showing (only for images in the window)
+        self._last_seen = {}
+        self._shown = 0
+
+    def add(self, image_ids):
+        """Remember images that were just shown, forgetting the oldest beyond the window"""
+        for image_id in image_ids:
+            self._shown += 1
+            self._recent.append((self._shown, image_id))
+            self._last_seen[image_id] = self._shown
+        while len(self._recent) > self.window:
+            seq, old = self._recent.popleft()
+            if self._last_seen.get(old) == seq:
+                del self._last_seen[old]
+
+    def last_seen(self, image_id):
+        """Sequence number of the image's latest showing, or -1 outside the window"""
+        return self._last_seen.get(image_id, -1)
+
+    def __contains__(self, image_id):
+        return image_id in self._last_seen
+
+    def __len__(self):
+        return len(self._last_seen)
+
+
+class ExposureDeck:
+    """Shuffle bag over the image IDs of one label"""
+
+    def __init__(self, rng):
+        self.rng = rng
+        self._cards = []
+        self._pos = 0
+        # Cards passed over by earlier draws, in order; dealt before the rest of the deck
+        self._carry = {}
+        self._members = set()
+        self._source = None
+        self.cycles = 0
+
+    def sync(self, image_ids):
+        """Follow a new tuple of image IDs: new images join the undealt part of the deck"""
+        if image_ids is self._source:
+            return
+        self._source = image_ids
+        current = set(image_ids)
+        for image_id in image_ids:
+            if image_id not in self._members:
+                self._cards.insert(self.rng.randint(self._pos, len(self._cards)), image_id)
+        # Removed images are dropped from the deck as they come up
+        self._members = current
+
+    def _next(self):
+        if self._carry:
+            card = next(iter(self._carry))
+            del self._carry[card]
+            return card
+        if self._pos >= len(self._cards):
+            # Start a new cycle; cards of removed images are dropped here
+            self._cards = [image_id for image_id in self._cards if image_id in self._members]
+            self.rng.shuffle(self._cards)
+            self._pos = 0
+            self.cycles += 1
+            if not self._cards:
+                raise NotEnoughImagesError("No images to deal")
+        card = self._cards[self._pos]
+        self._pos += 1
+        return card
+
+    def deal(self, count, allowed, history=None, on_pick=None):
+        """
+        Deal count distinct image IDs for which allowed(image_id) holds, preferring
+        images not in the ExposureHistory. on_pick(image_id) is called as each card is
+        kept, so allowed can depend on the cards picked so far.
+        """
+        picked = []
+        passed_over = []
+        seen_recent = []
+        # One full pass over the deck is enough to find every usable card
+        attempts = len(self._cards) + len(self._carry)
+        while len(picked) < count and attempts > 0:
+            attempts -= 1
+            card = self._next()
+            if card not in self._members:
+                continue
+            if card in picked or not allowed(card):
+                passed_over.append(card)
+            elif history is not None and card in history:
+                seen_recent.append(card)
+            else:
+                picked.append(card)
+                if on_pick is not None:
+                    on_pick(card)
+
+        # Not enough fresh images left: fall back to the least recently seen ones
+        if len(picked) < count and history is not None:
+            seen_recent.sort(key=history.last_seen)
+        for card in list(seen_recent):
+            if len(picked) == count:
+                break
+            if card not in picked and allowed(card):
+                picked.append(card)
+                seen_recent.remove(card)
+                if on_pick is not None:
+                    on_pick(card)
+
+        # Cards that lost their turn come up first next time
+        self._carry.update(dict.fromkeys(passed_over + seen_recent))
+        if len(picked) < count:
+            raise NotEnoughImagesError(f"Not enough distinct images: need {count}, found {len(picked)}")
+        return picked
+
+
+class ChallengeScheduler:
+    """Generates challenges from exposure decks and keeps a ready pool per level"""
+
+    def __init__(self, engine, pool_size=DEFAULT_POOL_SIZE, low_water=DEFAULT_LOW_WATER, executor=None):
+        """
+        Initialize the scheduler for a ChallengeEngine.
+        Pools are refilled on executor; when None, the scheduler starts its own worker thread.
+        """
+        self.engine = engine
+        self.pool_size = pool_size
+        self.low_water = low_water
+        self._executor = executor
+        self._own_executor = None
+
+        self._decks = {CAMPUS: ExposureDeck(engine.rng), EXTERNAL: ExposureDeck(engine.rng)}
+        # Ready challenges keyed by LevelRule.key, so an edited level never gets stale ones
+        self._pools = {}
+        self._refilling = set()
+
+        # How often each image has been shown, across every session
+        self.usage = Counter()
+
+        # Decks, pools and the engine's rng are shared with the refill thread
+        self._lock = threading.Lock()
+
+    def generate(self, level, history=None):
+        """Generate a challenge for a level, avoiding images in history where possible"""
+        engine = self.engine
+        rule = engine.rule(level)
+        records, ids_by_label = engine.catalog.snapshot()
+        groups = engine.dedup.groups if engine.dedup is not None else {}
+        used_groups = set()
+
+        def allowed(image_id):
+            return image_id in records and groups.get(image_id, image_id) not in used_groups
+
+        def on_pick(image_id):
+            used_groups.add(groups.get(image_id, image_id))
+
+        images = []
+        with self._lock:
+            for label, count in ((CAMPUS, rule.campus_count), (EXTERNAL, rule.external_count)):
+                deck = self._decks[label]
+                deck.sync(ids_by_label.get(label, ()))
+                images.extend(deck.deal(count, allowed, history, on_pick))
+            engine.rng.shuffle(images)
+        return engine.new_challenge(level, images)
+
+    def _pool(self, level):
+        key = self.engine.rule(level).key
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = self._pools[key] = deque()
+        return pool
+
+    def refill(self, level):
+        """Top up a level's pool (runs on the refill thread)"""
+        try:
+            while True:
+                with self._lock:
+                    pool = self._pool(level)
+                    if len(pool) >= self.pool_size:
+                        return
+                challenge = self.generate(level)
+                with self._lock:
+                    pool.append(challenge)
+        except NotEnoughImagesError:
+            pass
+        finally:
+            with self._lock:
+                self._refilling.discard(level)
+
+    def request_refill(self, level):
+        """Schedule a refill of a level's pool unless one is already running"""
+        with self._lock:
+            if level in self._refilling:
+                return
+            self._refilling.add(level)
+        executor = self._executor
+        if executor is None:
+            if self._own_executor is None:
+                self._own_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="challenge-pool")
+            executor = self._own_executor
+        executor.submit(self.refill, level)
+
+    def _find(self, level, history):
+        """
+        Move the pooled challenge that suits the session best to the front; returns the pool.
+        The one sharing the fewest images with the session's history wins, so the pool
+        serves the session even when the history cannot be avoided entirely.
+        """
+        catalog = self.engine.catalog
+        with self._lock:
+            pool = self._pool(level)
+            best_index = None
+            best_overlap = None
+            for index in range(min(len(pool), POOL_SCAN_LIMIT)):
+                challenge = pool[index]
+                if not all(image_id in catalog for image_id in challenge.image_ids):
+                    continue
+                overlap = 0 if history is None else sum(image_id in history for image_id in challenge.image_ids)
+                if best_overlap is None or overlap < best_overlap:
+                    best_index, best_overlap = index, overlap
+                    if overlap == 0:
+                        break
+            if best_index is not None:
+                if best_index:
+                    challenge = pool[best_index]
+                    del pool[best_index]
+                    pool.appendleft(challenge)
+                return pool
+        # Nothing pooled is usable: generate one for this session
+        challenge = self.generate(level, history)
+        with self._lock:
+            pool.appendleft(challenge)
+        return pool
+
+    def peek(self, level, history=None):
+        """Return the challenge the next take() will hand out, e.g. to decode its tiles early"""
+        pool = self._find(level, history)
+        with self._lock:
+            return pool[0]
+
+    def take(self, level, history=None):
+        """Remove and return a ready challenge for a level (call record() once it is shown)"""
+        pool = self._find(level, history)
+        with self._lock:
+            challenge = pool.popleft()
+            low = len(pool) < self.low_water
+        if low:
+            self.request_refill(level)
+        return challenge
+
+    def record(self, challenge, history=None):
+        """Count the images of a challenge that is being shown"""
+        with self._lock:
+            self.usage.update(challenge.image_ids)
+        if history is not None:
+            history.add(challenge.image_ids)
+
+    def issue(self, level, history=None):
+        """take() and record() in one step"""
+        challenge = self.take(level, history)
+        self.record(challenge, history)
+        return challenge
+
+    def clear(self):
+        """Drop every pooled challenge (e.g. after the catalog or duplicate groups changed)"""
+        with self._lock:
+            self._pools.clear()
+
+    def exposure_stats(self):
+        """Return min/max/mean times shown per label, to check that exposure stays balanced"""
+        stats = {}
+        for label, image_ids in self.engine.catalog.ids_by_label.items():
+            counts = [self.usage.get(image_id, 0) for image_id in image_ids]
+            if counts:
+                stats[label] = {"min": min(counts), "max": max(counts), "mean": sum(counts) / len(counts)}
+        return stats
+
+    def shutdown(self):
+        """Stop the scheduler's own refill thread"""
+        if self._own_executor is not None:
+            self._own_executor.shutdown(wait=False, cancel_futures=True)
+            self._own_executor = None
+
+
+class HistoryStore:
+    """Bounded LRU of ExposureHistory objects keyed by client ID"""
+
+    def __init__(self, max_clients=10000, window=DEFAULT_RECENT_WINDOW):
+        self.max_clients = max_clients
+        self.window = window
+        self._histories = OrderedDict()
+
+    def get(self, client_id):
+        """Return the history of a client, creating it when needed"""
+        history = self._histories.get(client_id)
+        if history is None:
+            history = self._histories[client_id] = ExposureHistory(self.window)
+            if len(self._histories) > self.max_clients:
+                self._histories.popitem(last=False)
+        else:
+            self._histories.move_to_end(client_id)
+        return history
@@ -0,0 +1,376 @@
+"""
+Asyncio HTTP service for the campus verification challenges.
+
+GET  /challenge?level=N  returns the whole grid as one JPEG plus a challenge token
+                          (X-Challenge-Token and grid geometry in the response headers);
+                          an optional &client=ID avoids images that client saw recently
+POST /verify             takes {"token": ..., "cells": [i, ...]} and returns pass or fail
+
+Grids are composited in a process pool from the on-disk thumbnail cache, and each
+worker keeps the popular tiles in a TileMemoryCache.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from challenge_engine import DEFAULT_LEVELS_PATH, ChallengeEngine, NotEnoughImagesError, load_levels
+from challenge_scheduler import ChallengeScheduler, HistoryStore
+from image_cache import DEFAULT_CACHE_DIR, DEFAULT_MEMORY_LIMIT, ThumbnailCache, TileMemoryCache, thumbnail_dimension
+from image_catalog import CAMPUS, EXTERNAL, ImageCatalog
+from image_dedup import DuplicateIndex
+from metrics import configure_from_env, metrics
+from sessions import SessionStore
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Gap between grid cells in the composite, matching the Tk grid padding
+CELL_GAP = 10
+BACKGROUND = "#f0f0f0"
+JPEG_QUALITY = 85
+
+# Largest request body accepted by /verify
+MAX_BODY_BYTES = 16 * 1024
+
+# Per-process caches used by compose_grid in the pool workers
+_thumbnail_cache = None
+_tile_cache = None
+
+
+def _init_worker(cache_dir, memory_limit):
+    """Set up the caches of a compositing worker process"""
+    global _thumbnail_cache, _tile_cache
+    _thumbnail_cache = ThumbnailCache(cache_dir)
+    _tile_cache = TileMemoryCache(max_bytes=memory_limit)
+
+
+def _load_tile(img_path, cell_size):
+    """Return a decoded RGB tile, from the worker's memory cache when possible"""
+    from PIL import Image
+
+    # Keyed by the source mtime so an image replaced in place is decoded again
+    mtime_ns = os.stat(img_path).st_mtime_ns
+    tile = _tile_cache.get(img_path, cell_size, mtime_ns)
+    if tile is None:
+        with Image.open(_thumbnail_cache.get(img_path, cell_size)) as cached:
+            tile = cached.convert("RGB")
+        _tile_cache.put(img_path, cell_size, mtime_ns, tile)
+    return tile
+
+
+def grid_geometry(rows, cols, cell_size):
+    """Return the (width, height) in pixels of a composited grid"""
+    return (cols * cell_size + (cols + 1) * CELL_GAP,
+            rows * cell_size + (rows + 1) * CELL_GAP)
+
+
+def compose_grid(tile_paths, rows, cols, cell_size):
+    """Paste the tiles of a challenge into one grid image and return it JPEG-encoded"""
+    from PIL import Image
+
+    if _thumbnail_cache is None:
+        # Called outside the pool (e.g. from the in-process client)
+        _init_worker(DEFAULT_CACHE_DIR, DEFAULT_MEMORY_LIMIT)
+
+    grid = Image.new("RGB", grid_geometry(rows, cols, cell_size), BACKGROUND)
+    # Thumbnails sit inside the 2px cell border
+    border = (cell_size - thumbnail_dimension(cell_size)) // 2
+    for i, img_path in enumerate(tile_paths):
+        x = CELL_GAP + (i % cols) * (cell_size + CELL_GAP) + border
+        y = CELL_GAP + (i // cols) * (cell_size + CELL_GAP) + border
+        try:
+            grid.paste(_load_tile(img_path, cell_size), (x, y))
+        except Exception as e:
+            print(f"Error loading image {img_path}: {e}")
+
+    out = io.BytesIO()
+    grid.save(out, format="JPEG", quality=JPEG_QUALITY)
+    return out.getvalue()
+
+
+class HttpError(Exception):
+    """Error turned into an HTTP error response"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class ChallengeServer:
+    """Issues composited challenge grids and verifies the submitted cells"""
+
+    def __init__(self, engine, executor=None):
+        """
+        Initialize the server for a ChallengeEngine.
+        executor runs compose_grid; when None, grids are composited on a thread instead.
+        """
+        self.engine = engine
+        self.executor = executor
+        # Open challenges; expiry only does work when a deadline is actually due
+        self.sessions = SessionStore()
+
+        # Ready-made challenges per level, and the images each client saw recently
+        self.scheduler = ChallengeScheduler(engine)
+        self.histories = HistoryStore()
+        for level in engine.levels:
+            self.scheduler.request_refill(level)
+
+    async def issue(self, level, client=None):
+        """Create a challenge and return (session, challenge, jpeg_bytes)"""
+        if level not in self.engine.levels:
+            raise HttpError(400, f"Unknown level {level}")
+        history = self.histories.get(client) if client else None
+        try:
+            challenge = self.scheduler.issue(level, history)
+        except NotEnoughImagesError as e:
+            raise HttpError(503, str(e))
+
+        records = self.engine.catalog.records
+        rule = challenge.rule
+        tile_paths = [records[image_id].path for image_id in challenge.image_ids]
+
+        loop = asyncio.get_running_loop()
+        with metrics.timer("grid_compose_seconds", level=level):
+            if self.executor is not None:
+                image = await loop.run_in_executor(self.executor, compose_grid,
+                                                   tile_paths, rule.rows, rule.cols, rule.cell_size)
+            else:
+                image = await asyncio.to_thread(compose_grid, tile_paths, rule.rows, rule.cols, rule.cell_size)
+        metrics.inc("challenges_issued_total", level=level)
+
+        # The clock starts once the grid is ready to go out
+        now = time.monotonic()
+        self.sessions.expire(now)
+        session = self.sessions.create(level, challenge.image_ids, challenge.campus_mask,
+                                       now + rule.time_limit)
+        return session, challenge, image
+
+    def verify(self, token, cells):
+        """Check the selected cell indices of a challenge (each token can be used once)"""
+        now = time.monotonic()
+        session = self.sessions.peek(token)
+        if session is None:
+            raise HttpError(404, "Unknown, expired or already used token")
+
+        # Check the cells before using up the token, so a bad request can be retried;
+        # only plain JSON integers count (not 2.7, 1e400 or true)
+        total_cells = len(session.image_ids)
+        for cell in cells:
+            if type(cell) is not int or not 0 <= cell < total_cells:
+                raise HttpError(400, "Invalid cell index")
+
+        self.sessions.pop(token)
+        self.sessions.expire(now)
+        for cell in cells:
+            session.selected_mask |= 1 << cell
+        result = self.engine.validate_mask(session.level, session.campus_mask, session.selected_mask,
+                                           expired=now >= session.deadline)
+        outcome = "timeout" if result.expired else "pass" if result.passed else "fail"
+        metrics.inc("verifications_total", level=session.level, outcome=outcome)
+        return result
+
+    async def handle(self, method, target, body=b""):
+        """Handle one request and return (status, headers, body)"""
+        url = urlsplit(target)
+        try:
+            if url.path == "/challenge":
+                if method != "GET":
+                    raise HttpError(405, "Use GET")
+                query = parse_qs(url.query)
+                try:
+                    level = int(query.get("level", ["1"])[0])
+                except ValueError:
+                    raise HttpError(400, "level must be an integer")
+
+                client = query.get("client", [None])[0]
+                session, challenge, image = await self.issue(level, client)
+                rule = challenge.rule
+                headers = {
+                    "Content-Type": "image/jpeg",
+                    "X-Challenge-Token": session.token,
+                    "X-Level": str(rule.level),
+                    "X-Grid-Rows": str(rule.rows),
+                    "X-Grid-Cols": str(rule.cols),
+                    "X-Cell-Size": str(rule.cell_size),
+                    "X-Cell-Gap": str(CELL_GAP),
+                    "X-Required-Selections": str(rule.required_selection_count),
+                    "X-Time-Limit": str(rule.time_limit),
+                }
+                return 200, headers, image
+
+            if url.path == "/verify":
+                if method != "POST":
+                    raise HttpError(405, "Use POST")
+                try:
+                    payload = json.loads(body or b"{}")
+                    token = payload["token"]
+                    cells = payload["cells"]
+                except (ValueError, KeyError, TypeError):
+                    raise HttpError(400, "Expected JSON with token and cells")
+                if not isinstance(token, str):
+                    raise HttpError(400, "token must be a string")
+                if not isinstance(cells, list):
+                    raise HttpError(400, "cells must be a list")
+
+                result = self.verify(token, cells)
+                return self._json(200, {
+                    "passed": result.passed,
+                    "expired": result.expired,
+                    "correct": result.campus_count,
+                    "incorrect": len(result.incorrect),
+                    "points": result.points,
+                })
+
+            raise HttpError(404, "Not found")
+        except HttpError as e:
+            return self._json(e.status, {"error": e.message})
+        except Exception as e:
+            # A bug must not drop the connection without a response
+            print(f"Error handling {method} {url.path}: {e!r}")
+            return self._json(500, {"error": "Internal server error"})
+
+    @staticmethod
+    def _json(status, data):
+        return status, {"Content-Type": "application/json"}, json.dumps(data).encode("utf-8")
+
+    async def _write_response(self, writer, status, resp_headers, body, keep_alive):
+        """Send one response; the Connection header follows keep_alive"""
+        head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}"]
+        head += [f"{name}: {value}" for name, value in resp_headers.items()]
+        head.append(f"Content-Length: {len(body)}")
+        head.append("Connection: " + ("keep-alive" if keep_alive else "close"))
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    async def handle_connection(self, reader, writer):
+        """Serve HTTP/1.1 requests on one connection (keep-alive supported)"""
+        try:
+            while True:
+                try:
+                    request_line = await reader.readline()
+                    if not request_line:
+                        break
+                    method, target, version = request_line.decode("latin-1").split()
+
+                    headers = {}
+                    while True:
+                        line = await reader.readline()
+                        if line in (b"\r\n", b"\n", b""):
+                            break
+                        name, _, value = line.decode("latin-1").partition(":")
+                        headers[name.strip().lower()] = value.strip()
+                except (ValueError, asyncio.LimitOverrunError):
+                    # A malformed request line, or a line longer than the stream limit:
+                    # the rest of the stream cannot be trusted, so answer and close
+                    await self._write_response(writer, *self._json(400, {"error": "Malformed request"}),
+                                               keep_alive=False)
+                    break
+
+                try:
+                    length = int(headers.get("content-length", "0") or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    # The body cannot be skipped without a length, so the connection ends here
+                    status, resp_headers, body = self._json(400, {"error": "Invalid Content-Length"})
+                    keep_alive = False
+                elif length > MAX_BODY_BYTES:
+                    status, resp_headers, body = self._json(413, {"error": "Request body too large"})
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b""
+                    status, resp_headers, body = await self.handle(method, target, body)
+                    keep_alive = (headers.get("connection", "").lower() != "close" and
+                                  version == "HTTP/1.1")
+
+                await self._write_response(writer, status, resp_headers, body, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8080):
+        """Listen for HTTP connections until cancelled"""
+        server = await asyncio.start_server(self.handle_connection, host, port, backlog=1024)
+        print(f"Challenge server listening on http://{host}:{port}")
+        exporter = asyncio.create_task(self._export_metrics()) if metrics.enabled else None
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if exporter is not None:
+                exporter.cancel()
+
+    async def _export_metrics(self, interval=15.0):
+        """Periodically export metrics from a worker thread"""
+        while True:
+            await asyncio.sleep(interval)
+            metrics.set_gauge("open_sessions", len(self.sessions))
+            await asyncio.to_thread(metrics.export)
+
+
+class InProcessClient:
+    """Calls a ChallengeServer directly, without sockets, for local testing"""
+
+    def __init__(self, server):
+        self.server = server
+
+    async def get_challenge(self, level=1, client=None):
+        """Request a challenge; returns (status, headers, jpeg_bytes)"""
+        target = f"/challenge?level={level}"
+        if client:
+            target += f"&client={client}"
+        return await self.server.handle("GET", target)
+
+    async def verify(self, token, cells):
+        """Submit cell indices; returns (status, decoded JSON)"""
+        body = json.dumps({"token": token, "cells": list(cells)}).encode("utf-8")
+        status, _, data = await self.server.handle("POST", "/verify", body)
+        return status, json.loads(data)
+
+
+def build_server(campus_dir, external_dir, workers=None, levels_path=DEFAULT_LEVELS_PATH):
+    """Create a ChallengeServer over the given image directories with a compositing pool"""
+    catalog = ImageCatalog({CAMPUS: campus_dir, EXTERNAL: external_dir})
+    dedup = DuplicateIndex(catalog)
+    dedup.update()
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                   initargs=(DEFAULT_CACHE_DIR, DEFAULT_MEMORY_LIMIT))
+    return ChallengeServer(ChallengeEngine(catalog, load_levels(levels_path), dedup=dedup), executor)
+
+
+def main():
+    """Run the challenge server from the command line"""
+    parser = argparse.ArgumentParser(description="Campus verification challenge server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=None, help="compositing processes")
+    parser.add_argument("--campus-dir", default=os.path.join(BASE_DIR, "campus_images"))
+    parser.add_argument("--external-dir", default=os.path.join(BASE_DIR, "external_images"))
+    parser.add_argument("--levels", default=DEFAULT_LEVELS_PATH, help="level definitions (JSON)")
+    args = parser.parse_args()
+
+    configure_from_env()
+    server = build_server(args.campus_dir, args.external_dir, args.workers, args.levels)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.scheduler.shutdown()
+        server.executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
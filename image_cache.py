@@ -0,0 +1,193 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from metrics import metrics
+
+# Grid cell sizes used by display_image_grid (4x4, 3x3 and 2x2 grids)
+CELL_SIZES = (150, 180, 220)
+
+# Thumbnails are stored as baseline JPEG, which decodes fastest at these sizes
+TILE_FORMAT = "JPEG"
+TILE_EXTENSION = ".jpg"
+TILE_QUALITY = 90
+
+# Transparent sources are flattened onto the window background colour
+TILE_BACKGROUND = "#f0f0f0"
+
+# Default memory budget for decoded tiles kept by TileMemoryCache (bytes)
+DEFAULT_MEMORY_LIMIT = 64 * 1024 * 1024
+
+# Default location of the on-disk thumbnail cache, next to this module
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".thumbnail_cache")
+
+
+def thumbnail_dimension(cell_size):
+    """Return the edge length of the thumbnail shown in a cell of the given size"""
+    # Leave room for the 2px cell border on each side
+    return cell_size - 4
+
+
+def render_tile(img_path, cell_size):
+    """
+    Open a source image and normalize it for a grid cell: apply the EXIF orientation,
+    flatten transparency, and center-crop to a square RGB tile.
+    """
+    from PIL import Image, ImageOps
+
+    dim = thumbnail_dimension(cell_size)
+    with Image.open(img_path) as src:
+        # Let the JPEG decoder downscale while decoding (no-op for other formats)
+        src.draft("RGB", (dim * 2, dim * 2))
+        img = ImageOps.exif_transpose(src)
+        if img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info:
+            img = img.convert("RGBA")
+            flat = Image.new("RGB", img.size, TILE_BACKGROUND)
+            flat.paste(img, mask=img.getchannel("A"))
+            img = flat
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+        return ImageOps.fit(img, (dim, dim), Image.LANCZOS)
+
+
+class ThumbnailCache:
+    """Persistent on-disk cache of pre-sized grid thumbnails"""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, sizes=CELL_SIZES):
+        """Initialize the cache rooted at cache_dir for the given cell sizes"""
+        self.cache_dir = cache_dir
+        self.sizes = tuple(sizes)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _source_key(self, img_path):
+        """Stable short key for a source image path"""
+        return hashlib.sha1(os.path.abspath(img_path).encode("utf-8")).hexdigest()[:16]
+
+    def entry_path(self, img_path, cell_size, mtime_ns=None):
+        """Return the cache file for img_path at cell_size (it may not exist yet)"""
+        if mtime_ns is None:
+            mtime_ns = os.stat(img_path).st_mtime_ns
+        name = f"{self._source_key(img_path)}_{mtime_ns}_{cell_size}{TILE_EXTENSION}"
+        return os.path.join(self.cache_dir, name)
+
+    def _purge_stale(self, img_path, cell_size, keep):
+        """Remove entries for img_path/cell_size left over from older source versions"""
+        prefix = self._source_key(img_path) + "_"
+        suffix = f"_{cell_size}"
+        for name in os.listdir(self.cache_dir):
+            # Entries written in an older tile format are stale as well
+            if name.startswith(prefix) and os.path.splitext(name)[0].endswith(suffix) and name != keep:
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+
+    def get(self, img_path, cell_size):
+        """Return the path of the cached thumbnail, building it if needed"""
+        path = self.entry_path(img_path, cell_size)
+        if os.path.exists(path):
+            metrics.inc("thumbnail_cache_lookups_total", result="hit")
+        else:
+            metrics.inc("thumbnail_cache_lookups_total", result="miss")
+            self._purge_stale(img_path, cell_size, os.path.basename(path))
+            with metrics.timer("thumbnail_render_seconds", cell_size=cell_size):
+                tile = render_tile(img_path, cell_size)
+            # Write to a temp file first so a half-written thumbnail is never served
+            tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+            tile.save(tmp_path, format=TILE_FORMAT, quality=TILE_QUALITY)
+            os.replace(tmp_path, path)
+        return path
+
+    def build(self, img_paths):
+        """Make sure every image has a thumbnail for every cell size"""
+        failed = []
+        for img_path in img_paths:
+            for cell_size in self.sizes:
+                try:
+                    self.get(img_path, cell_size)
+                except Exception as e:
+                    print(f"Error caching thumbnail for {img_path}: {e}")
+                    failed.append(img_path)
+                    break
+        return failed
+
+
+class TileMemoryCache:
+    """
+    Size-aware in-memory LRU of resized PIL tiles keyed by (path, source mtime_ns,
+    cell size), so a source modified in place never gets its old tile back.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MEMORY_LIMIT):
+        """Initialize an empty cache that holds at most max_bytes of pixel data"""
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        # Tiles are stored from loader worker threads and read on the main thread
+        self._lock = threading.Lock()
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def tile_bytes(pil_img):
+        """Approximate memory used by a decoded tile"""
+        width, height = pil_img.size
+        return width * height * len(pil_img.getbands())
+
+    def get(self, img_path, cell_size, mtime_ns):
+        """Return the cached tile or None, marking it as most recently used"""
+        key = (img_path, mtime_ns, cell_size)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, img_path, cell_size, mtime_ns, pil_img):
+        """Store a tile, evicting least recently used tiles to stay within max_bytes"""
+        key = (img_path, mtime_ns, cell_size)
+        size = self.tile_bytes(pil_img)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self._entries[key] = (pil_img, size)
+            self.current_bytes += size
+
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every cached tile (counters are kept)"""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Return a snapshot of the cache counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
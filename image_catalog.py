@@ -0,0 +1,318 @@
+import json
+import os
+import threading
+
+# Image labels used by the verification levels
+CAMPUS = "campus"
+EXTERNAL = "external"
+
+# File extensions picked up when scanning an image directory
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.avif')
+
+# Default location of the saved scan manifest, next to this module
+DEFAULT_MANIFEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".image_catalog.json")
+
+# Bumped whenever the manifest layout changes so old files are ignored
+MANIFEST_VERSION = 1
+
+
+class ImageRecord:
+    """Metadata for a single picture in the catalog"""
+
+    __slots__ = ("image_id", "label", "name", "path", "format", "file_size", "mtime_ns")
+
+    def __init__(self, image_id, label, name, path, format, file_size, mtime_ns):
+        self.image_id = image_id
+        self.label = label
+        self.name = name
+        self.path = path
+        self.format = format
+        self.file_size = file_size
+        self.mtime_ns = mtime_ns
+
+    @property
+    def is_campus(self):
+        return self.label == CAMPUS
+
+    def __repr__(self):
+        return f"ImageRecord({self.image_id!r}, {self.path!r})"
+
+
+def make_image_id(label, name):
+    """Build the stable ID of an image from its label and file name"""
+    # The label prefix keeps IDs unique even when both folders share a file name
+    return f"{label}/{name}"
+
+
+class ImageCatalog:
+    """
+    Hash-indexed catalog of campus and external images.
+    The scan result is saved to a manifest; on later launches only directories whose
+    mtime changed are listed again. A directory mtime does not change when a file is
+    edited in place, so the files of unchanged directories are stat()ed instead.
+    refresh() applies the same checks while running.
+    """
+
+    def __init__(self, roots, extensions=IMAGE_EXTENSIONS, manifest_path=DEFAULT_MANIFEST_PATH,
+                 trust_manifest=False):
+        """
+        Load the catalog for the image directories.
+        roots maps a label (CAMPUS, EXTERNAL) to the directory holding its images.
+        Pass manifest_path=None to always scan and never save a manifest.
+        With trust_manifest=True, saved directories are loaded from the manifest even if
+        they changed since, and their files are not stat()ed; the next refresh() checks them.
+        """
+        self.roots = {label: os.path.abspath(path) for label, path in roots.items()}
+        self.extensions = tuple(extensions)
+        self.manifest_path = manifest_path
+
+        # (records, ids_by_label) is replaced as one tuple, never mutated, so readers
+        # on other threads always see a consistent snapshot
+        self._snapshot = ({}, {})
+
+        # Per-label directory state: (root, dir mtime_ns, records)
+        self._dirs = {}
+        self._lock = threading.Lock()
+
+        saved = self._load_manifest()
+        records = {}
+        ids_by_label = {}
+        for label, root in self.roots.items():
+            entry = saved.get(label)
+            if (entry is not None and entry["root"] == root and
+                    (trust_manifest or entry["mtime_ns"] == self._dir_mtime(root))):
+                label_records = [self._record_from_manifest(label, root, item) for item in entry["files"]]
+                self._dirs[label] = (root, entry["mtime_ns"], label_records)
+                if not trust_manifest:
+                    self._dirs[label] = self._restat(label, self._dirs[label])
+            else:
+                self._dirs[label] = self._scan(label, root)
+            label_records = self._dirs[label][2]
+            records.update((record.image_id, record) for record in label_records)
+            ids_by_label[label] = tuple(record.image_id for record in label_records)
+
+        self._snapshot = (records, ids_by_label)
+        if saved != self._manifest_entries():
+            self.save_manifest()
+
+    @staticmethod
+    def _dir_mtime(root):
+        """Return the mtime of a directory, or None if it does not exist"""
+        try:
+            return os.stat(root).st_mtime_ns
+        except OSError:
+            return None
+
+    def _make_record(self, label, root, name, file_size, mtime_ns):
+        """Build an ImageRecord for a file in root"""
+        return ImageRecord(
+            make_image_id(label, name),
+            label,
+            name,
+            os.path.join(root, name),
+            os.path.splitext(name)[1][1:].lower(),
+            file_size,
+            mtime_ns
+        )
+
+    def _record_from_manifest(self, label, root, item):
+        """Rebuild a record from a manifest [name, size, mtime_ns] entry"""
+        name, file_size, mtime_ns = item
+        return self._make_record(label, root, name, file_size, mtime_ns)
+
+    def _scan(self, label, root):
+        """List every image in root and return its (root, mtime_ns, records) state"""
+        # Take the mtime before listing so a change during the scan triggers another one
+        mtime_ns = self._dir_mtime(root)
+        records = []
+        if mtime_ns is not None:
+            for entry in sorted(os.scandir(root), key=lambda e: e.name):
+                if not entry.is_file() or not entry.name.lower().endswith(self.extensions):
+                    continue
+                stat = entry.stat()
+                records.append(self._make_record(label, root, entry.name, stat.st_size, stat.st_mtime_ns))
+        return (root, mtime_ns, records)
+
+    def _restat(self, label, state):
+        """
+        Stat the files of a directory whose listing is unchanged and return its state
+        with fresh records for files modified in place (the same state when none were).
+        """
+        root, mtime_ns, records = state
+        updated = []
+        modified = False
+        for record in records:
+            try:
+                stat = os.stat(record.path)
+            except OSError:
+                # Gone although the directory looked unchanged: list it again
+                return self._scan(label, root)
+            if stat.st_size != record.file_size or stat.st_mtime_ns != record.mtime_ns:
+                record = self._make_record(label, root, record.name, stat.st_size, stat.st_mtime_ns)
+                modified = True
+            updated.append(record)
+        return (root, mtime_ns, updated) if modified else state
+
+    def _load_manifest(self):
+        """Read the saved manifest, returning {} when it is missing or unusable"""
+        if not self.manifest_path:
+            return {}
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get("version") != MANIFEST_VERSION or data.get("extensions") != list(self.extensions):
+            return {}
+        return data.get("dirs", {})
+
+    def _manifest_entries(self):
+        """Return the manifest form of the current directory state"""
+        return {
+            label: {
+                "root": root,
+                "mtime_ns": mtime_ns,
+                "files": [[r.name, r.file_size, r.mtime_ns] for r in records]
+            }
+            for label, (root, mtime_ns, records) in self._dirs.items()
+        }
+
+    def save_manifest(self):
+        """Write the current scan state so the next launch can skip unchanged directories"""
+        if not self.manifest_path:
+            return
+        data = {
+            "version": MANIFEST_VERSION,
+            "extensions": list(self.extensions),
+            "dirs": self._manifest_entries()
+        }
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.manifest_path)
+        except OSError as e:
+            print(f"Error saving image catalog manifest {self.manifest_path}: {e}")
+
+    def refresh(self):
+        """
+        Rescan directories whose mtime changed since the last scan, and stat the files
+        of the others.
+        Returns (added_ids, removed_ids, modified_ids); all empty when nothing changed.
+        """
+        with self._lock:
+            changed = False
+            for label, state in list(self._dirs.items()):
+                if self._dir_mtime(state[0]) != state[1]:
+                    new_state = self._scan(label, self.roots[label])
+                else:
+                    new_state = self._restat(label, state)
+                if new_state is not state:
+                    self._dirs[label] = new_state
+                    changed = True
+            if not changed:
+                return [], [], []
+
+            old_records = self.records
+            records = {}
+            ids_by_label = {}
+            for label, (_, _, label_records) in self._dirs.items():
+                records.update((record.image_id, record) for record in label_records)
+                ids_by_label[label] = tuple(record.image_id for record in label_records)
+
+            # Swap in the new indexes in one step
+            self._snapshot = (records, ids_by_label)
+            self.save_manifest()
+
+            added = [image_id for image_id in records if image_id not in old_records]
+            removed = [image_id for image_id in old_records if image_id not in records]
+            modified = [image_id for image_id, record in records.items()
+                        if image_id in old_records and
+                        (record.mtime_ns, record.file_size) !=
+                        (old_records[image_id].mtime_ns, old_records[image_id].file_size)]
+            return added, removed, modified
+
+    def snapshot(self):
+        """Return a consistent (records, ids_by_label) pair"""
+        return self._snapshot
+
+    @property
+    def records(self):
+        return self._snapshot[0]
+
+    @property
+    def ids_by_label(self):
+        return self._snapshot[1]
+
+    @property
+    def campus_ids(self):
+        return self.ids_by_label.get(CAMPUS, ())
+
+    @property
+    def external_ids(self):
+        return self.ids_by_label.get(EXTERNAL, ())
+
+    def get(self, image_id):
+        """Return the record for an image ID"""
+        return self.records[image_id]
+
+    def path(self, image_id):
+        """Return the absolute path of an image"""
+        return self.records[image_id].path
+
+    def is_campus(self, image_id):
+        """Check whether an image ID refers to a campus image"""
+        return self.records[image_id].label == CAMPUS
+
+    def __contains__(self, image_id):
+        return image_id in self.records
+
+    def __len__(self):
+        return len(self.records)
+
+    def paths(self):
+        """Return the paths of every image in the catalog"""
+        return [record.path for record in self.records.values()]
+
+
+class CatalogWatcher:
+    """
+    Polls the catalog directories on a background thread and applies changes.
+    Directory mtimes change whenever a file is added, removed or renamed, so only
+    changed directories are listed again; each poll also stats every file to catch
+    files edited in place.
+    """
+
+    def __init__(self, catalog, interval=2.0, on_change=None):
+        """
+        Initialize the watcher.
+        on_change(added_ids, removed_ids, modified_ids) is called on the watcher thread after a change.
+        """
+        self.catalog = catalog
+        self.interval = interval
+        self.on_change = on_change
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start polling in a daemon thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="catalog-watcher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop polling"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                added, removed, modified = self.catalog.refresh()
+            except OSError as e:
+                print(f"Error refreshing image catalog: {e}")
+                continue
+            if (added or removed or modified) and self.on_change is not None:
+                self.on_change(added, removed, modified)
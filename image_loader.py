@@ -0,0 +1,157 @@
+import os
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from metrics import metrics
+
+
+class BackgroundImageLoader:
+    """Decodes grid tiles on a worker pool and hands them back to the Tk main thread"""
+
+    def __init__(self, root, thumbnail_cache, memory_cache=None, max_workers=4, poll_ms=15):
+        """Initialize the loader for the given Tk root, thumbnail cache and optional tile LRU"""
+        self.root = root
+        self.thumbnail_cache = thumbnail_cache
+        self.memory_cache = memory_cache
+        self.poll_ms = poll_ms
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tile-loader")
+
+        # Finished tiles waiting to be picked up by the main thread
+        self._results = queue.Queue()
+        self._poll_id = None
+
+        # Decodes started ahead of time, keyed by (img_path, source mtime_ns, cell_size).
+        # Only kept until the next grid starts: finished tiles live in the memory cache
+        self._prefetched = {}
+
+        # Each load_grid call bumps the generation so late tiles from an old grid are dropped
+        self._generation = 0
+        self._on_tile = None
+        self._on_done = None
+        self._outstanding = 0
+
+    def _decode(self, img_path, cell_size):
+        """Load the pre-sized thumbnail for a cell (runs on a worker thread)"""
+        from PIL import Image
+
+        # Stat before reading: a source modified in between is cached under its older mtime
+        mtime_ns = os.stat(img_path).st_mtime_ns
+        with metrics.timer("tile_decode_seconds", cell_size=cell_size):
+            pil_img = Image.open(self.thumbnail_cache.get(img_path, cell_size))
+            # Force the decode here rather than lazily on the main thread
+            pil_img.load()
+        if self.memory_cache is not None:
+            self.memory_cache.put(img_path, cell_size, mtime_ns, pil_img)
+        return pil_img
+
+    @staticmethod
+    def _key(img_path, cell_size):
+        """Cache key of a tile; None for the mtime when the source is gone (the decode reports it)"""
+        try:
+            mtime_ns = os.stat(img_path).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        return (img_path, mtime_ns, cell_size)
+
+    def _submit(self, key):
+        img_path, mtime_ns, cell_size = key
+        if self.memory_cache is not None and mtime_ns is not None:
+            pil_img = self.memory_cache.get(img_path, cell_size, mtime_ns)
+            metrics.inc("tile_cache_lookups_total", result="miss" if pil_img is None else "hit")
+            if pil_img is not None:
+                # Already decoded: hand back a completed future without touching the pool
+                future = Future()
+                future.set_result(pil_img)
+                return future
+        return self.executor.submit(self._decode, img_path, cell_size)
+
+    def submit(self, img_path, cell_size):
+        """Schedule a single tile decode and return its future"""
+        return self._submit(self._key(img_path, cell_size))
+
+    def _drop_finished(self):
+        """Forget prefetched tiles that are done; the memory cache holds them from here on"""
+        if self.memory_cache is not None:
+            self._prefetched = {key: future for key, future in self._prefetched.items()
+                                if not future.done()}
+
+    def prefetch(self, tiles):
+        """Start decoding tiles for a future grid; tiles is a list of (img_path, cell_size)"""
+        self._drop_finished()
+        for img_path, cell_size in tiles:
+            key = self._key(img_path, cell_size)
+            if key not in self._prefetched:
+                self._prefetched[key] = self._submit(key)
+
+    def load_grid(self, tiles, on_tile, on_done):
+        """
+        Decode tiles in the background.
+        tiles is a list of (index, img_path, cell_size). on_tile(index, pil_img, error) is called
+        on the main thread as each tile finishes, then on_done() once all of them have arrived.
+        """
+        self._generation += 1
+        generation = self._generation
+        self._on_tile = on_tile
+        self._on_done = on_done
+        self._outstanding = len(tiles)
+
+        # Prefetches this grid does not use are dropped (decodes still running finish
+        # into the memory cache)
+        prefetched = self._prefetched
+        self._prefetched = {}
+
+        if not tiles:
+            self.root.after_idle(on_done)
+            return
+
+        for index, img_path, cell_size in tiles:
+            key = self._key(img_path, cell_size)
+            future = prefetched.get(key)
+            if future is None:
+                future = self._submit(key)
+            future.add_done_callback(
+                lambda f, index=index: self._results.put((generation, index, f))
+            )
+
+        # Deliver prefetched tiles right away; the rest are picked up by polling
+        if self._poll_id is not None:
+            self.root.after_cancel(self._poll_id)
+            self._poll_id = None
+        self._poll()
+
+    def cancel(self):
+        """Drop any tiles still in flight for the current grid"""
+        self._generation += 1
+        self._outstanding = 0
+        self._drop_finished()
+
+    def _poll(self):
+        """Deliver finished tiles on the main thread"""
+        self._poll_id = None
+        while True:
+            try:
+                generation, index, future = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if generation != self._generation:
+                continue
+
+            error = future.exception()
+            self._on_tile(index, None if error else future.result(), error)
+            if generation != self._generation:
+                # The callback started a new grid
+                continue
+            self._outstanding -= 1
+            if self._outstanding == 0:
+                self._on_done()
+
+        if self._outstanding > 0:
+            self._poll_id = self.root.after(self.poll_ms, self._poll)
+
+    def shutdown(self):
+        """Stop polling and release the worker threads"""
+        self.cancel()
+        if self._poll_id is not None:
+            self.root.after_cancel(self._poll_id)
+            self._poll_id = None
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,225 @@
+"""
+Runs several kiosks on one host over one shared image cache.
+
+The launcher scans the image directories, renders the thumbnails, packs the tile
+atlases and hashes near-duplicates once. Then it starts N kiosk processes: Tk windows,
+or headless sessions for load testing. The kiosks do no image preparation of their own.
+They map the shared atlases read-only, so every process shares the same physical pages
+through the page cache, and memory and CPU grow with the number of distinct images, not
+with the number of kiosks. While the kiosks run, the launcher watches the directories
+and rebuilds the shared cache. Kiosks remap the atlases when the files change.
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import random
+import sys
+import time
+
+from challenge_engine import DEFAULT_LEVELS_PATH, ChallengeEngine, cell_sizes, load_levels
+from challenge_scheduler import ChallengeScheduler, ExposureHistory
+from image_cache import DEFAULT_CACHE_DIR, ThumbnailCache
+from image_catalog import CAMPUS, EXTERNAL, CatalogWatcher, ImageCatalog
+from image_dedup import DuplicateIndex
+from normalize_images import normalize
+from tile_atlas import atlas_path, build_atlases, open_atlases
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def prepare_shared_cache(catalog, cache_dir, sizes, workers=None):
+    """Bring thumbnails, atlases and near-duplicate hashes up to date for every kiosk"""
+    start = time.perf_counter()
+    counts = normalize(catalog.paths(), cache_dir, sizes, workers)
+    rebuilt = build_atlases(catalog, cache_dir, sizes)
+    hashed = DuplicateIndex(catalog).update()
+    print(f"Shared cache ready in {time.perf_counter() - start:.2f}s: "
+          f"{counts['rendered'] + counts['reused']} images normalized, "
+          f"atlases rebuilt for {rebuilt or 'none'}, {hashed} images hashed")
+
+
+def memory_usage():
+    """Return this process's memory use in KiB: rss, pss (Linux only) and shared"""
+    usage = {}
+    try:
+        with open("/proc/self/smaps_rollup", "r", encoding="ascii") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in ("Rss", "Pss", "Shared_Clean", "Shared_Dirty"):
+                    usage[name.lower()] = int(value.split()[0])
+    except OSError:
+        import resource
+        usage["rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage
+
+
+def run_kiosk(image_roots, cache_dir):
+    """Kiosk process: one Tk window over the shared cache"""
+    import test88
+    test88.main(image_roots, cache_dir, shared_cache=True)
+
+
+def play_headless(index, image_roots, cache_dir, levels_path, duration):
+    """
+    Play verification sessions as fast as possible for duration seconds, reading every
+    tile of every grid from the shared atlases, and return the throughput and memory use.
+    """
+    rng = random.Random(index)
+    catalog = ImageCatalog(image_roots)
+    levels = load_levels(levels_path)
+    dedup = DuplicateIndex(catalog)
+    dedup.update(hash_missing=False)
+    engine = ChallengeEngine(catalog, levels, rng=rng, dedup=dedup)
+    scheduler = ChallengeScheduler(engine)
+    history = ExposureHistory()
+    thumbnail_cache = ThumbnailCache(cache_dir, cell_sizes(levels))
+    atlases = open_atlases(cache_dir, thumbnail_cache.sizes)
+
+    grids = 0
+    tiles = 0
+    atlas_misses = 0
+    passed = 0
+    level = 1
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        challenge = scheduler.take(level, history)
+        scheduler.record(challenge, history)
+        atlas = atlases.get(challenge.rule.cell_size)
+        records = catalog.records
+        for image_id in challenge.image_ids:
+            tile = atlas.image(image_id, records[image_id].mtime_ns) if atlas else None
+            if tile is None:
+                # Not packed yet: decode the shared thumbnail like the kiosk's loader would
+                from PIL import Image
+                atlas_misses += 1
+                tile = Image.open(thumbnail_cache.get(records[image_id].path, challenge.rule.cell_size))
+            # Touch every pixel, as building the PhotoImage would
+            tile.getextrema()
+            tiles += 1
+        grids += 1
+
+        # A mostly honest user: usually picks the campus images, sometimes one wrong tile
+        for image_id in challenge.image_ids:
+            if (image_id in challenge.campus_ids) != (rng.random() < 0.1):
+                challenge.toggle(image_id)
+        result = engine.validate(challenge)
+        if result.passed:
+            passed += 1
+            level = level + 1 if level < engine.level_count else 1
+        else:
+            level = 1
+
+    scheduler.shutdown()
+    return {"kiosk": index, "grids": grids, "tiles": tiles, "atlas_misses": atlas_misses,
+            "passed": passed, "memory": memory_usage()}
+
+
+def run_headless(index, image_roots, cache_dir, levels_path, duration, results):
+    """Headless kiosk process: reports play_headless() results, or its error, on the results queue"""
+    try:
+        results.put(play_headless(index, image_roots, cache_dir, levels_path, duration))
+    except Exception as e:
+        # Report the failure so the launcher does not wait for this kiosk
+        results.put({"kiosk": index, "error": repr(e)})
+        raise
+
+
+def collect_reports(processes, results, poll_interval=1.0):
+    """Wait for one report per headless kiosk, giving up once every kiosk has exited"""
+    reports = []
+    while len(reports) < len(processes):
+        try:
+            reports.append(results.get(timeout=poll_interval))
+        except queue.Empty:
+            if not any(process.is_alive() for process in processes):
+                # Killed kiosks never report; pick up what the others sent just before exiting
+                while len(reports) < len(processes):
+                    try:
+                        reports.append(results.get(timeout=poll_interval))
+                    except queue.Empty:
+                        break
+                break
+    reported = {report["kiosk"] for report in reports}
+    for index, process in enumerate(processes):
+        if index not in reported:
+            print(f"{process.name} exited with code {process.exitcode} without a report", file=sys.stderr)
+    return reports
+
+
+def print_headless_report(reports, duration, cache_dir, sizes):
+    """Print per-kiosk throughput and memory next to the size of the shared atlases"""
+    paths = [atlas_path(cache_dir, cell_size) for cell_size in sizes]
+    atlas_kib = sum(os.path.getsize(path) for path in paths if os.path.exists(path)) // 1024
+    print(f"Shared atlases: {atlas_kib} KiB")
+    total_pss = 0
+    for report in sorted(reports, key=lambda r: r["kiosk"]):
+        if "error" in report:
+            print(f"Kiosk {report['kiosk']}: failed with {report['error']}")
+            continue
+        memory = report["memory"]
+        total_pss += memory.get("pss", 0)
+        print(f"Kiosk {report['kiosk']}: {report['grids'] / duration:.0f} grids/s, "
+              f"{report['atlas_misses']} atlas misses, rss {memory.get('rss', 0)} KiB, "
+              f"pss {memory.get('pss', 'n/a')} KiB")
+    if total_pss:
+        played = sum(1 for report in reports if "error" not in report)
+        print(f"Total pss across {played} kiosks: {total_pss} KiB")
+
+
+def main():
+    """Run the kiosk launcher from the command line"""
+    parser = argparse.ArgumentParser(description="Run several kiosks over one shared image cache")
+    parser.add_argument("--kiosks", type=int, default=2)
+    parser.add_argument("--headless", action="store_true", help="run headless sessions instead of windows")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per headless kiosk")
+    parser.add_argument("--campus-dir", default=os.path.join(BASE_DIR, "campus_images"))
+    parser.add_argument("--external-dir", default=os.path.join(BASE_DIR, "external_images"))
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--levels", default=DEFAULT_LEVELS_PATH, help="level definitions (JSON)")
+    parser.add_argument("--workers", type=int, default=None, help="processes for thumbnail rendering")
+    args = parser.parse_args()
+
+    image_roots = {CAMPUS: args.campus_dir, EXTERNAL: args.external_dir}
+    sizes = cell_sizes(load_levels(args.levels))
+    catalog = ImageCatalog(image_roots)
+    prepare_shared_cache(catalog, args.cache_dir, sizes, args.workers)
+
+    # Spawn (not fork) so no kiosk inherits the launcher's threads or Tk state
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    if args.headless:
+        processes = [context.Process(target=run_headless, name=f"kiosk-{i}",
+                                     args=(i, image_roots, args.cache_dir, args.levels, args.duration, results))
+                     for i in range(args.kiosks)]
+    else:
+        processes = [context.Process(target=run_kiosk, name=f"kiosk-{i}", args=(image_roots, args.cache_dir))
+                     for i in range(args.kiosks)]
+    for process in processes:
+        process.start()
+
+    # Keep the shared cache current while the kiosks run
+    def rebuild(added, removed, modified):
+        prepare_shared_cache(catalog, args.cache_dir, sizes, args.workers)
+
+    watcher = CatalogWatcher(catalog, on_change=rebuild)
+    watcher.start()
+    reports = []
+    try:
+        reports = collect_reports(processes, results) if args.headless else []
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+    finally:
+        watcher.stop()
+
+    if reports:
+        print_headless_report(reports, args.duration, args.cache_dir, sizes)
+    if any(process.exitcode for process in processes):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
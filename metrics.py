@@ -0,0 +1,234 @@
+"""
+Lightweight instrumentation for the verification flow.
+
+A process-wide Metrics registry records counters, timings and histograms and exports
+them through pluggable sinks (Prometheus text file, JSON lines). While disabled, every
+recording call returns after a single attribute check, so hot paths can stay
+instrumented in production.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+
+# Histogram bucket upper bounds in seconds (Prometheus "le" values)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0, 120.0)
+
+
+class Histogram:
+    """Cumulative-bucket histogram of observed values"""
+
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # Last slot is +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class _NullTimer:
+    """Context manager used while metrics are disabled"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    """Context manager that observes its elapsed time into a histogram"""
+
+    __slots__ = ("metrics", "name", "labels", "start")
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+class Metrics:
+    """Registry of counters, gauges and histograms"""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.sinks = []
+        self._lock = threading.Lock()
+
+    def enable(self, *sinks):
+        """Turn recording on and add export sinks"""
+        self.sinks.extend(sinks)
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def inc(self, name, amount=1, **labels):
+        """Add to a counter"""
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        """Set a gauge to its current value"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.gauges[_key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        """Record a value (usually seconds) in a histogram"""
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def timer(self, name, **labels):
+        """Context manager that records the duration of its block in a histogram"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, labels)
+
+    def snapshot(self):
+        """Return a JSON-friendly copy of every metric"""
+        def label_dict(labels):
+            return dict(labels)
+
+        with self._lock:
+            return {
+                "timestamp": time.time(),
+                "counters": [{"name": n, "labels": label_dict(l), "value": v}
+                             for (n, l), v in self.counters.items()],
+                "gauges": [{"name": n, "labels": label_dict(l), "value": v}
+                           for (n, l), v in self.gauges.items()],
+                "histograms": [{"name": n, "labels": label_dict(l), "buckets": list(h.buckets),
+                                "counts": list(h.counts), "sum": h.total, "count": h.count}
+                               for (n, l), h in self.histograms.items()],
+            }
+
+    def export(self):
+        """Write the current metrics to every sink"""
+        if not self.sinks:
+            return
+        snapshot = self.snapshot()
+        for sink in self.sinks:
+            try:
+                sink.write(snapshot)
+            except OSError as e:
+                print(f"Error exporting metrics to {sink}: {e}")
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels.items()) + (list(extra.items()) if extra else [])
+    if not items:
+        return ""
+    body = ",".join(f'{k}="{str(v)}"' for k, v in items)
+    return "{" + body + "}"
+
+
+class PrometheusTextfileSink:
+    """Writes metrics in Prometheus text format (for the node_exporter textfile collector)"""
+
+    def __init__(self, path, prefix="campus_verification_"):
+        self.path = path
+        self.prefix = prefix
+
+    def __repr__(self):
+        return f"PrometheusTextfileSink({self.path!r})"
+
+    def write(self, snapshot):
+        lines = []
+        for kind, entries in (("counter", snapshot["counters"]), ("gauge", snapshot["gauges"])):
+            for name in sorted({e["name"] for e in entries}):
+                lines.append(f"# TYPE {self.prefix}{name} {kind}")
+                for e in entries:
+                    if e["name"] == name:
+                        lines.append(f"{self.prefix}{name}{_format_labels(e['labels'])} {e['value']}")
+
+        histograms = snapshot["histograms"]
+        for name in sorted({h["name"] for h in histograms}):
+            lines.append(f"# TYPE {self.prefix}{name} histogram")
+            for h in histograms:
+                if h["name"] != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(h["buckets"]) + ["+Inf"], h["counts"]):
+                    cumulative += count
+                    le = {"le": bound if bound == "+Inf" else repr(float(bound))}
+                    lines.append(f"{self.prefix}{name}_bucket{_format_labels(h['labels'], le)} {cumulative}")
+                lines.append(f"{self.prefix}{name}_sum{_format_labels(h['labels'])} {h['sum']}")
+                lines.append(f"{self.prefix}{name}_count{_format_labels(h['labels'])} {h['count']}")
+
+        # Write atomically so the collector never reads a partial file
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.path)
+
+
+class JsonLinesSink:
+    """Appends one JSON snapshot per export to a file"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __repr__(self):
+        return f"JsonLinesSink({self.path!r})"
+
+    def write(self, snapshot):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(snapshot) + "\n")
+
+
+# Process-wide registry used by the rest of the app (disabled until enable() is called)
+metrics = Metrics()
+
+
+def configure_from_env(environ=os.environ):
+    """
+    Enable metrics from environment variables:
+    CAMPUS_METRICS_PROM (Prometheus text file path) and CAMPUS_METRICS_JSONL (JSON lines path).
+    Returns True when at least one sink was configured.
+    """
+    sinks = []
+    if environ.get("CAMPUS_METRICS_PROM"):
+        sinks.append(PrometheusTextfileSink(environ["CAMPUS_METRICS_PROM"]))
+    if environ.get("CAMPUS_METRICS_JSONL"):
+        sinks.append(JsonLinesSink(environ["CAMPUS_METRICS_JSONL"]))
+    if sinks:
+        metrics.enable(*sinks)
+    return bool(sinks)
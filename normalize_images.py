@@ -0,0 +1,156 @@
+"""
+Offline image normalization.
+
+Streams every source image through a process pool and writes the three grid cell-size
+variants into the thumbnail cache: EXIF orientation applied, transparency flattened,
+center-cropped to square, stored as baseline JPEG (see image_cache.render_tile).
+
+A content-hash manifest makes runs incremental. Sources whose size and mtime are
+unchanged are skipped without being read. Sources that were only touched (new mtime,
+same SHA-256) have their existing tiles renamed instead of re-rendered. Finally the
+tiles are packed into the memory-mapped atlases (see tile_atlas).
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+from challenge_engine import DEFAULT_LEVELS_PATH, cell_sizes, load_levels
+from image_cache import CELL_SIZES, DEFAULT_CACHE_DIR, ThumbnailCache
+from image_catalog import CAMPUS, EXTERNAL, ImageCatalog
+from tile_atlas import build_atlases
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+MANIFEST_NAME = "normalize_manifest.json"
+MANIFEST_VERSION = 1
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """Hash a file without reading it into memory at once"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(path, sizes):
+    """Read the manifest ({} when missing, unreadable or built for other cell sizes)"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get("version") != MANIFEST_VERSION or data.get("sizes") != list(sizes):
+        return {}
+    return data.get("sources", {})
+
+
+def save_manifest(path, sizes, sources):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": MANIFEST_VERSION, "sizes": list(sizes), "sources": sources}, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def _normalize_one(job):
+    """Worker: bring the tiles of one source up to date; returns (path, entry, status, error)"""
+    img_path, cache_dir, sizes, old_entry = job
+    cache = ThumbnailCache(cache_dir, sizes)
+    try:
+        stat = os.stat(img_path)
+        sha256 = file_sha256(img_path)
+        entry = {"sha256": sha256, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+        if old_entry and old_entry.get("sha256") == sha256:
+            # Same content under a new mtime: move the existing tiles to their new names
+            old_paths = [cache.entry_path(img_path, size, old_entry["mtime_ns"]) for size in sizes]
+            if all(os.path.exists(p) for p in old_paths):
+                for size, old_path in zip(sizes, old_paths):
+                    os.replace(old_path, cache.entry_path(img_path, size, stat.st_mtime_ns))
+                return img_path, entry, "reused", None
+
+        for size in sizes:
+            cache.get(img_path, size)
+        return img_path, entry, "rendered", None
+    except Exception as e:
+        return img_path, None, "failed", str(e)
+
+
+def normalize(paths, cache_dir=DEFAULT_CACHE_DIR, sizes=CELL_SIZES, workers=None, force=False):
+    """Normalize the given source images; returns a dict of counts per status"""
+    cache = ThumbnailCache(cache_dir, sizes)
+    manifest_path = os.path.join(cache_dir, MANIFEST_NAME)
+    sources = {} if force else load_manifest(manifest_path, sizes)
+
+    counts = {"skipped": 0, "rendered": 0, "reused": 0, "failed": 0}
+    jobs = []
+    for img_path in paths:
+        entry = sources.get(img_path)
+        try:
+            stat = os.stat(img_path)
+        except OSError:
+            continue
+        up_to_date = (entry is not None and entry["size"] == stat.st_size and
+                      entry["mtime_ns"] == stat.st_mtime_ns and
+                      all(os.path.exists(cache.entry_path(img_path, size, stat.st_mtime_ns))
+                          for size in sizes))
+        if up_to_date:
+            counts["skipped"] += 1
+        else:
+            if force:
+                for size in sizes:
+                    try:
+                        os.remove(cache.entry_path(img_path, size, stat.st_mtime_ns))
+                    except OSError:
+                        pass
+            jobs.append((img_path, cache_dir, tuple(sizes), entry))
+
+    if jobs:
+        with Pool(processes=workers) as pool:
+            for img_path, entry, status, error in pool.imap_unordered(_normalize_one, jobs, chunksize=4):
+                counts[status] += 1
+                if entry is not None:
+                    sources[img_path] = entry
+                else:
+                    sources.pop(img_path, None)
+                    print(f"Error normalizing {img_path}: {error}", file=sys.stderr)
+
+    # Forget sources that no longer exist
+    wanted = set(paths)
+    sources = {path: entry for path, entry in sources.items() if path in wanted}
+    save_manifest(manifest_path, sizes, sources)
+    return counts
+
+
+def main():
+    """Run the normalization pipeline from the command line"""
+    parser = argparse.ArgumentParser(description="Normalize campus/external images into grid tiles")
+    parser.add_argument("--campus-dir", default=os.path.join(BASE_DIR, "campus_images"))
+    parser.add_argument("--external-dir", default=os.path.join(BASE_DIR, "external_images"))
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--levels", default=DEFAULT_LEVELS_PATH, help="level definitions (cell sizes)")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--force", action="store_true", help="re-render every image")
+    args = parser.parse_args()
+
+    catalog = ImageCatalog({CAMPUS: args.campus_dir, EXTERNAL: args.external_dir}, manifest_path=None)
+    start = time.perf_counter()
+    sizes = cell_sizes(load_levels(args.levels))
+    counts = normalize(catalog.paths(), args.cache_dir, sizes, args.workers, args.force)
+    rebuilt = build_atlases(catalog, args.cache_dir, sizes)
+    elapsed = time.perf_counter() - start
+    print(f"Normalized {len(catalog)} images in {elapsed:.2f}s: "
+          f"{counts['rendered']} rendered, {counts['reused']} reused, "
+          f"{counts['skipped']} unchanged, {counts['failed']} failed; "
+          f"atlases rebuilt for cell sizes {rebuilt or 'none'}")
+    if counts["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Session store for many concurrent verifications.
+
+Each session is a small __slots__ record holding the grid as a tuple of image IDs and the
+campus cells and selection as integer bitmasks (bit i = grid cell i). Deadlines are
+absolute time.monotonic() values kept in a heap, so expiring sessions costs nothing
+until a deadline is actually due, however many sessions are open.
+"""
+import heapq
+import secrets
+import time
+
+
+class Session:
+    """State of one user's verification"""
+
+    __slots__ = ("token", "level", "points", "image_ids", "campus_mask", "selected_mask", "deadline")
+
+    def __init__(self, token, level, image_ids, campus_mask, deadline, points=0):
+        self.token = token
+        self.level = level
+        self.points = points
+        self.image_ids = image_ids  # Grid contents, cell order
+        self.campus_mask = campus_mask  # Bit i set when cell i is a campus image
+        self.selected_mask = 0  # Bit i set when cell i is selected
+        self.deadline = deadline  # time.monotonic() value
+
+    def toggle(self, cell):
+        """Toggle the selection of a grid cell"""
+        self.selected_mask ^= 1 << cell
+
+    def time_remaining(self, now=None):
+        """Seconds left before the deadline"""
+        if now is None:
+            now = time.monotonic()
+        return max(0.0, self.deadline - now)
+
+
+class SessionStore:
+    """Token-indexed sessions with heap-driven deadline expiry"""
+
+    def __init__(self, on_expire=None):
+        """Initialize an empty store; on_expire(session) is called for each expired session"""
+        self.sessions = {}
+        self.on_expire = on_expire
+        # (deadline, token) entries; stale entries are skipped when popped
+        self._deadlines = []
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __contains__(self, token):
+        return token in self.sessions
+
+    def create(self, level, image_ids, campus_mask, deadline, points=0):
+        """Open a session and return it"""
+        token = secrets.token_urlsafe(16)
+        session = Session(token, level, image_ids, campus_mask, deadline, points)
+        self.sessions[token] = session
+        heapq.heappush(self._deadlines, (deadline, token))
+        return session
+
+    def set_deadline(self, session, deadline):
+        """Move a session's deadline (e.g. when it moves on to the next level)"""
+        session.deadline = deadline
+        heapq.heappush(self._deadlines, (deadline, session.token))
+
+    def get(self, token, now=None):
+        """Return a live session, or None if it is unknown or past its deadline"""
+        session = self.sessions.get(token)
+        if session is None:
+            return None
+        if now is None:
+            now = time.monotonic()
+        if now >= session.deadline:
+            self._expire_session(session)
+            return None
+        return session
+
+    def peek(self, token):
+        """Return a session (expired or not) without removing it, or None if unknown"""
+        return self.sessions.get(token)
+
+    def pop(self, token):
+        """Remove and return a session (expired or not), or None if unknown"""
+        # Its heap entry is dropped lazily when it comes due
+        return self.sessions.pop(token, None)
+
+    def _expire_session(self, session):
+        del self.sessions[session.token]
+        if self.on_expire is not None:
+            self.on_expire(session)
+
+    def next_deadline(self):
+        """Earliest pending deadline, or None when no session is open"""
+        while self._deadlines:
+            deadline, token = self._deadlines[0]
+            session = self.sessions.get(token)
+            if session is not None and session.deadline == deadline:
+                return deadline
+            heapq.heappop(self._deadlines)
+        return None
+
+    def expire(self, now=None):
+        """Drop every session whose deadline has passed; returns how many were dropped"""
+        if now is None:
+            now = time.monotonic()
+        expired = 0
+        deadlines = self._deadlines
+        while deadlines and deadlines[0][0] <= now:
+            deadline, token = heapq.heappop(deadlines)
+            session = self.sessions.get(token)
+            # Skip entries for sessions that were removed or got a new deadline
+            if session is not None and session.deadline == deadline:
+                self._expire_session(session)
+                expired += 1
+        return expired
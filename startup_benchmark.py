@@ -0,0 +1,178 @@
+"""
+Cold-start benchmark for the kiosk.
+
+Starts the kiosk in a fresh interpreter several times and measures, from process launch,
+when the window is first shown and when the first grid is interactive (every tile drawn,
+timer running). Exits with status 1 when any run misses --target-ms. Timing the real
+window needs a display (e.g. Xvfb). With --no-tk, or when Tk cannot open a display, each
+run times the same startup work without the window instead: imports, levels, the catalog
+from its manifest, the atlases, and the first challenge with its tiles.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Time-to-first-interactive-grid every run has to beat (ms)
+DEFAULT_TARGET_MS = 1000
+
+
+def probe_tk(image_roots, cache_dir, timeout):
+    """Start the real kiosk and return wall-clock marks of its startup"""
+    import tkinter as tk
+    import test88
+
+    marks = {"imported": time.time()}
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        return {"tk_unavailable": str(e)}
+
+    def shown(event):
+        if event.widget is root and "window_shown" not in marks:
+            marks["window_shown"] = time.time()
+            marks["pil_loaded_before_window"] = "PIL" in sys.modules
+
+    root.bind("<Map>", shown, add="+")
+    app = test88.VerificationSystem(root, image_roots, cache_dir)
+
+    grid_ready = app.grid_ready
+
+    def interactive():
+        grid_ready()
+        # Draw the finished grid before taking the time
+        root.update_idletasks()
+        marks["grid_interactive"] = time.time()
+        root.after_idle(root.destroy)
+
+    app.grid_ready = interactive
+    root.after(int(timeout * 1000), root.destroy)
+    root.mainloop()
+    if app.catalog_watcher is not None:
+        app.catalog_watcher.stop()
+    app.image_loader.shutdown()
+    return marks
+
+
+def probe_headless(image_roots, cache_dir):
+    """Run the kiosk's startup steps without a window and return wall-clock marks"""
+    import test88  # noqa: F401  (the kiosk's own imports)
+    from challenge_engine import ChallengeEngine, cell_sizes, load_levels
+    from challenge_scheduler import ChallengeScheduler, ExposureHistory
+    from image_cache import ThumbnailCache
+    from image_catalog import ImageCatalog
+    from image_dedup import DuplicateIndex
+    from tile_atlas import open_atlases
+
+    marks = {"imported": time.time(), "pil_loaded_before_window": "PIL" in sys.modules}
+    levels = load_levels()
+    thumbnail_cache = ThumbnailCache(cache_dir, cell_sizes(levels))
+    # The kiosk shows its window with placeholder tiles at this point
+    marks["window_shown"] = time.time()
+
+    catalog = ImageCatalog(image_roots, trust_manifest=True)
+    atlases = open_atlases(cache_dir, thumbnail_cache.sizes)
+    dedup = DuplicateIndex(catalog)
+    dedup.update(hash_missing=False)
+    engine = ChallengeEngine(catalog, levels, dedup=dedup)
+    scheduler = ChallengeScheduler(engine)
+    challenge = scheduler.take(1, ExposureHistory())
+    cell_size = challenge.rule.cell_size
+    atlas = atlases.get(cell_size)
+    records = catalog.records
+    atlas_misses = 0
+    for image_id in challenge.image_ids:
+        tile = atlas.image(image_id, records[image_id].mtime_ns) if atlas else None
+        if tile is None:
+            from PIL import Image
+            atlas_misses += 1
+            tile = Image.open(thumbnail_cache.get(records[image_id].path, cell_size))
+        # Copy the pixels out, as building the PhotoImage would
+        tile.tobytes()
+    marks["grid_interactive"] = time.time()
+    marks["atlas_misses"] = atlas_misses
+    scheduler.shutdown()
+    return marks
+
+
+def run_once(mode, args):
+    """Start one probe process; returns its marks as milliseconds since launch"""
+    command = [sys.executable, os.path.abspath(__file__), "--probe", mode,
+               "--campus-dir", args.campus_dir, "--external-dir", args.external_dir,
+               "--cache-dir", args.cache_dir, "--timeout", str(args.timeout)]
+    launched = time.time()
+    completed = subprocess.run(command, capture_output=True, text=True, cwd=BASE_DIR,
+                               timeout=args.timeout + 30)
+    if completed.returncode != 0:
+        raise RuntimeError(f"Startup probe failed:\n{completed.stderr}")
+    # The kiosk prints progress of its own; the marks are the last line
+    marks = json.loads(completed.stdout.strip().splitlines()[-1])
+    if "tk_unavailable" in marks:
+        return marks
+    return {name: (value - launched) * 1000 if name in ("imported", "window_shown", "grid_interactive") else value
+            for name, value in marks.items()}
+
+
+def main():
+    """Run the startup benchmark from the command line"""
+    parser = argparse.ArgumentParser(description="Measure kiosk time-to-first-interactive-grid")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--target-ms", type=float, default=DEFAULT_TARGET_MS,
+                        help="fail when a run takes longer to show an interactive grid")
+    parser.add_argument("--no-tk", action="store_true", help="time the startup work without a window")
+    parser.add_argument("--campus-dir", default=os.path.join(BASE_DIR, "campus_images"))
+    parser.add_argument("--external-dir", default=os.path.join(BASE_DIR, "external_images"))
+    parser.add_argument("--cache-dir", default=None, help="thumbnail cache (default: the kiosk's)")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds before a probe gives up")
+    parser.add_argument("--probe", choices=("tk", "headless"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.cache_dir is None:
+        from image_cache import DEFAULT_CACHE_DIR
+        args.cache_dir = DEFAULT_CACHE_DIR
+
+    if args.probe:
+        from image_catalog import CAMPUS, EXTERNAL
+        image_roots = {CAMPUS: args.campus_dir, EXTERNAL: args.external_dir}
+        if args.probe == "tk":
+            marks = probe_tk(image_roots, args.cache_dir, args.timeout)
+        else:
+            marks = probe_headless(image_roots, args.cache_dir)
+        print(json.dumps(marks))
+        return
+
+    mode = "headless" if args.no_tk else "tk"
+    runs = []
+    while len(runs) < args.runs:
+        marks = run_once(mode, args)
+        if "tk_unavailable" in marks:
+            print(f"Tk unavailable, timing startup without the window: {marks['tk_unavailable']}",
+                  file=sys.stderr)
+            mode = "headless"
+            continue
+        if "grid_interactive" not in marks:
+            print(f"Run {len(runs) + 1}: no interactive grid within {args.timeout:.0f}s", file=sys.stderr)
+            sys.exit(1)
+        runs.append(marks)
+        print(f"Run {len(runs)} ({mode}): imports {marks['imported']:.0f} ms, "
+              f"window {marks['window_shown']:.0f} ms, interactive grid {marks['grid_interactive']:.0f} ms"
+              + (f", {marks['atlas_misses']} atlas misses" if marks.get("atlas_misses") else ""))
+
+    interactive = sorted(marks["grid_interactive"] for marks in runs)
+    median = interactive[len(interactive) // 2]
+    worst = interactive[-1]
+    print(f"Time to first interactive grid: median {median:.0f} ms, max {worst:.0f} ms "
+          f"(target {args.target_ms:.0f} ms)")
+    if any(marks.get("pil_loaded_before_window") for marks in runs):
+        print("Warning: PIL was imported before the window was shown", file=sys.stderr)
+    if worst > args.target_ms:
+        print(f"Startup missed the target by {worst - args.target_ms:.0f} ms", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
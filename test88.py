@@ -1,61 +1,159 @@
 import tkinter as tk
 from tkinter import messagebox, Label, Button, Frame
-import random
+import argparse
+import math
 import os
-from PIL import Image, ImageTk
 import time
+from image_cache import DEFAULT_CACHE_DIR, DEFAULT_MEMORY_LIMIT, ThumbnailCache, TileMemoryCache
+from image_loader import BackgroundImageLoader
+from tile_atlas import atlas_mtimes, build_atlases, open_atlases
+from image_catalog import CAMPUS, EXTERNAL, CatalogWatcher, ImageCatalog
+from image_dedup import DuplicateIndex
+from challenge_engine import ChallengeEngine, NotEnoughImagesError, cell_sizes, load_levels
+from challenge_scheduler import ChallengeScheduler, ExposureHistory
+from metrics import configure_from_env, metrics
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def format_duration(seconds):
+    """Spell out a time limit, e.g. 30 -> 30 seconds, 120 -> 2 minutes"""
+    minutes, seconds = divmod(int(seconds), 60)
+    parts = []
+    if minutes:
+        parts.append(f"{minutes} minute" + ("s" if minutes != 1 else ""))
+    if seconds or not minutes:
+        parts.append(f"{seconds} second" + ("s" if seconds != 1 else ""))
+    return " ".join(parts)
 
 class VerificationSystem:
-    """Visual Campus Verification System for Automated Access Control with 3 Levels"""
+    """Visual Campus Verification System for Automated Access Control with levels from levels.json"""
     
-    def __init__(self, root):
-        """Initialize the verification system with the root window"""
+    def __init__(self, root, image_roots=None, cache_dir=DEFAULT_CACHE_DIR, shared_cache=False):
+        """
+        Initialize the verification system with the root window.
+        image_roots maps CAMPUS/EXTERNAL to image directories. With shared_cache, another
+        process (kiosk_launcher) builds the thumbnails, atlases and hashes in cache_dir
+        and this kiosk only maps them.
+        """
         self.root = root
         self.root.title("Campus Verification System")
         self.root.geometry("800x700")
         self.root.configure(bg="#f0f0f0")
         
-        # Paths to campus and external images
-        self.campus_images_path = "C:\\Users\\ultra\\meME\\campus_images"
-        self.external_images_path = "C:\\Users\\ultra\\meME\\external_images"
-        
-        # Load image lists from directories
-        self.all_campus_images = [f for f in os.listdir(self.campus_images_path) 
-                                 if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-        self.all_external_images = [f for f in os.listdir(self.external_images_path) 
-                                   if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+        # Paths to campus and external images (by default the directories next to this module)
+        image_roots = image_roots or {}
+        self.campus_images_path = image_roots.get(CAMPUS, os.path.join(BASE_DIR, "campus_images"))
+        self.external_images_path = image_roots.get(EXTERNAL, os.path.join(BASE_DIR, "external_images"))
+        self.shared_cache = shared_cache
+        
+        # Grid shapes, campus counts, time limits, cell sizes and points per level
+        self.levels = load_levels()
+        
+        # Tiles are decoded on a worker pool so the Tk event loop never blocks,
+        # and decoded tiles are kept in a bounded LRU shared across challenges
+        self.tile_memory_limit = DEFAULT_MEMORY_LIMIT  # bytes
+        self.thumbnail_cache = ThumbnailCache(cache_dir, cell_sizes(self.levels))
+        self.tile_memory_cache = TileMemoryCache(max_bytes=self.tile_memory_limit)
+        self.image_loader = BackgroundImageLoader(self.root, self.thumbnail_cache, self.tile_memory_cache)
+        
+        # Catalog, atlases, duplicate groups and challenge pools are set up by
+        # finish_startup once the window is on screen
+        self.catalog = None
+        self.tile_atlases = {}
+        self.atlas_mtimes = ()
+        self.catalog_watcher = None
+        self.duplicate_index = None
+        self.engine = None
+        self.scheduler = None
+        self.exposure_history = ExposureHistory()
         
         # Level tracking (reversed order)
         self.current_level = 1  # Now starting with what was previously level 3
-        self.selected_images = []
+        self.challenge = None
         
         # Points system
         self.total_points = 0
-        self.points_per_correct = 5
         
         # Timer variables
+        # The level clock is a monotonic deadline on the challenge; time_remaining is only
+        # the whole number of seconds currently shown
         self.time_remaining = 0
         self.timer_id = None
         self.timer_label = None
         
-        # Time limits for each level (in seconds)
-        self.time_limits = {
-            1: 30,    # Level 1: 30 seconds
-            2: 60,    # Level 2: 1 minute
-            3: 120    # Level 3: 2 minutes
-        }
+        # Minimum time between timer repaints (ms); raise it to wake idle kiosks less often
+        self.timer_repaint_ms = 1000
+        
+        # Instrumentation timestamps (perf_counter) for the current grid
+        self.grid_started_at = None
+        self.grid_shown_at = None
+        self.first_click_seen = False
+        
+        # How often metrics are exported when instrumentation is enabled (ms)
+        self.metrics_export_ms = 15000
+        if metrics.enabled:
+            self.root.after(self.metrics_export_ms, self.export_metrics)
         
         # UI elements
         self.header_label = None
         self.instruction_label = None
         self.image_frame = None
         self.submit_button = None
-        self.image_buttons = []
+        self.image_buttons = {}
         self.current_images = []
+        self.current_records = {}
         self.points_label = None
         
-        # Start the verification process
+        # Show the window with placeholder tiles at once; after_idle + after(0) lets Tk
+        # draw it before the image work starts
+        self.startup_started_at = time.perf_counter()
         self.create_ui()
+        self.show_placeholder_grid(self.levels[0])
+        self.root.after_idle(self.root.after, 0, self.finish_startup)
+    
+    def finish_startup(self):
+        """Load the catalog, atlases and challenge pools, then show the first real grid"""
+        # Index the images in both directories by stable ID, straight from the saved
+        # manifest; the watcher's first poll rescans directories that changed since
+        self.catalog = ImageCatalog({
+            CAMPUS: self.campus_images_path,
+            EXTERNAL: self.external_images_path
+        }, trust_manifest=True)
+        
+        # Tiles already packed into the memory-mapped atlases need no decoding at all
+        cache_dir = self.thumbnail_cache.cache_dir
+        sizes = self.thumbnail_cache.sizes
+        self.tile_atlases = open_atlases(cache_dir, sizes)
+        self.atlas_mtimes = atlas_mtimes(cache_dir, sizes)
+        
+        if self.shared_cache:
+            # The launcher rebuilds the shared atlases; remap them when they change
+            self.shared_cache_poll_ms = 5000
+            self.root.after(self.shared_cache_poll_ms, self.watch_shared_cache)
+        else:
+            # Pre-build thumbnails and atlases for every grid cell size in the background
+            # (only missing or stale ones are rendered)
+            self.image_loader.executor.submit(self.refresh_tiles, self.catalog.paths())
+        
+        # Pick up images added to or removed from the directories while running
+        self.catalog_watcher = CatalogWatcher(self.catalog, on_change=self.catalog_changed)
+        self.catalog_watcher.start()
+        
+        # Group near-duplicate pictures so a grid never shows the same scene twice
+        # (the saved hashes are grouped now, before the first grid is drawn; new images
+        # are hashed in the background)
+        self.duplicate_index = DuplicateIndex(self.catalog)
+        self.duplicate_index.update(hash_missing=False)
+        
+        # Level rules, sampling, selection tracking and scoring live in the headless engine
+        self.engine = ChallengeEngine(self.catalog, self.levels, dedup=self.duplicate_index)
+        
+        # Challenges come from pools refilled in the background; images are dealt so
+        # every picture gets shown, and the kiosk avoids the ones it showed recently
+        self.scheduler = ChallengeScheduler(self.engine, executor=self.image_loader.executor)
+        self.image_loader.executor.submit(self.refresh_duplicates)
+        
+        # Start the verification process
         self.load_level()
     
     def create_ui(self):
@@ -133,7 +231,7 @@ class VerificationSystem:
         # Status bar
         self.status_bar = Label(
             self.root,
-            text="Level 1 of 3",
+            text=f"Level 1 of {len(self.levels)}",
             font=("Arial", 10),
             bg="#e0e0e0",
             bd=1,
@@ -144,82 +242,84 @@ class VerificationSystem:
     
     def load_level(self):
         """Load images for the current level"""
-        # Clear any existing selection
-        self.selected_images = []
-        
         # Cancel any existing timer
         if self.timer_id:
             self.root.after_cancel(self.timer_id)
             self.timer_id = None
         
+        # Show the full time for this level; the countdown starts in grid_ready
+        self.time_remaining = self.engine.rule(self.current_level).time_limit
+        self.update_timer_display()
+        
         # Update UI for current level
-        if self.current_level == 1:  # Original level 3
-            # Level 1: 2x2 grid with 1 campus image to select
-            time_text = "30 seconds"
-            self.instruction_label.config(
-                text=f"LEVEL 1: Select the ONE campus image from the 2x2 grid below. Each correct campus image is worth 5 points. You have {time_text}."
-            )
-            self.status_bar.config(text="Level 1 of 3")
-            
-            # Make sure we have enough images
-            if len(self.all_campus_images) < 1 or len(self.all_external_images) < 3:
-                messagebox.showerror("Error", "Not enough images in directories. Please add more images.")
-                return
-            
-            campus_images = random.sample(self.all_campus_images, 1)
-            external_images = random.sample(self.all_external_images, 3)
-            self.current_images = campus_images + external_images
-            random.shuffle(self.current_images)
-            
-            # Create a 2x2 grid
-            self.display_image_grid(2, 2)
-            
-        elif self.current_level == 2:  # Original level 2 with modification
-            # Level 2: 3x3 grid with 3 campus images to select (changed from 4)
-            time_text = "1 minute"
-            self.instruction_label.config(
-                text=f"LEVEL 2: Select all 3 campus images from the 3x3 grid below. Each correct campus image is worth 5 points. You have {time_text}."
-            )
-            self.status_bar.config(text="Level 2 of 3")
-            
-            # Check if we have enough images for this level
-            if len(self.all_campus_images) < 3 or len(self.all_external_images) < 6:
-                messagebox.showerror("Error", "Not enough images in directories. Please add more images.")
-                return
-            
-            campus_images = random.sample(self.all_campus_images, 3)  # Changed from 4 to 3
-            external_images = random.sample(self.all_external_images, 6)  # Changed from 5 to 6
-            self.current_images = campus_images + external_images
-            random.shuffle(self.current_images)
-            
-            # Create a 3x3 grid
-            self.display_image_grid(3, 3)
-            
-        elif self.current_level == 3:  # Original level 1
-            # Level 3: 4x4 grid with 6 campus images to select
-            time_text = "2 minutes"
-            self.instruction_label.config(
-                text=f"LEVEL 3: Select all 6 campus images from the 4x4 grid below. Each correct campus image is worth 5 points. You have {time_text}."
-            )
-            self.status_bar.config(text="Level 3 of 3")
-            
-            # Check if we have enough images for this level
-            if len(self.all_campus_images) < 6 or len(self.all_external_images) < 10:
-                messagebox.showerror("Error", "Not enough images in directories. Please add more images.")
-                return
-            
-            campus_images = random.sample(self.all_campus_images, 6)
-            external_images = random.sample(self.all_external_images, 10)
-            self.current_images = campus_images + external_images
-            random.shuffle(self.current_images)
-            
-            # Create a 4x4 grid
-            self.display_image_grid(4, 4)
+        rule = self.engine.rule(self.current_level)
+        self.instruction_label.config(text=self.instruction_text(rule))
+        self.status_bar.config(text=f"Level {rule.level} of {self.engine.level_count}")
+        
+        # Make sure we have enough images
+        if not self.engine.can_generate(rule.level):
+            messagebox.showerror("Error", "Not enough images in directories. Please add more images.")
+            return
+        
+        # Use the challenge prepared during the previous grid when there is one
+        try:
+            self.challenge = self.scheduler.take(rule.level, self.exposure_history)
+        except NotEnoughImagesError:
+            # Too many near-duplicates to fill the grid with distinct pictures
+            messagebox.showerror("Error", "Not enough images in directories. Please add more images.")
+            return
+        self.scheduler.record(self.challenge, self.exposure_history)
+        self.current_images = list(self.challenge.image_ids)
+        
+        self.display_image_grid(rule.rows, rule.cols)
+    
+    def show_placeholder_grid(self, rule):
+        """Draw the grid of a level with empty cells while the images are still being indexed"""
+        self.instruction_label.config(text=self.instruction_text(rule))
+        self.timer_label.config(text=f"Time: {rule.time_limit // 60:02d}:{rule.time_limit % 60:02d}")
         
-        # Start the timer for this level
-        self.time_remaining = self.time_limits[self.current_level]
-        self.update_timer_display()
-        self.start_timer()
+        grid_frame = Frame(self.image_frame, bg="#f0f0f0")
+        grid_frame.pack(pady=10)
+        for i in range(rule.rows * rule.cols):
+            frame = Frame(
+                grid_frame,
+                width=rule.cell_size,
+                height=rule.cell_size,
+                bd=2,
+                relief=tk.RAISED
+            )
+            frame.grid(row=i//rule.cols, column=i%rule.cols, padx=5, pady=5)
+            frame.grid_propagate(False)
+            tk.Label(frame, text="Loading...", bg="#e0e0e0").pack(fill=tk.BOTH, expand=True)
+    
+    @staticmethod
+    def instruction_text(rule):
+        """Build the instructions shown above the grid of a level"""
+        if rule.single_select:
+            task = f"Select the ONE campus image from the {rule.rows}x{rule.cols} grid below."
+        else:
+            task = f"Select all {rule.campus_count} campus images from the {rule.rows}x{rule.cols} grid below."
+        return (f"LEVEL {rule.level}: {task} Each correct campus image is worth "
+                f"{rule.points_per_correct} points. You have {format_duration(rule.time_limit)}.")
+    
+    def prefetch_level(self, level):
+        """Create the challenge for a level ahead of time and start decoding its tiles"""
+        if not self.engine.can_generate(level):
+            return
+        
+        # The challenge stays first in the pool, so load_level takes this one
+        try:
+            challenge = self.scheduler.peek(level, self.exposure_history)
+        except NotEnoughImagesError:
+            # load_level reports it when the level is actually played
+            return
+        
+        records = self.catalog.records
+        image_size = challenge.rule.cell_size
+        atlas = self.tile_atlases.get(image_size)
+        self.image_loader.prefetch([(records[image_id].path, image_size)
+                                    for image_id in challenge.image_ids
+                                    if image_id in records and not (atlas and image_id in atlas)])
     
     def display_image_grid(self, rows, cols):
         """Display images in a grid layout"""
@@ -227,15 +327,18 @@ class VerificationSystem:
         for widget in self.image_frame.winfo_children():
             widget.destroy()
         
-        self.image_buttons = []
+        self.grid_started_at = time.perf_counter()
+        self.grid_shown_at = None
+        self.first_click_seen = False
+        
+        self.image_buttons = {}
+        
+        # Keep the records of the images on screen even if the catalog changes meanwhile
+        records = self.catalog.records
+        self.current_records = {image_id: records[image_id] for image_id in self.current_images}
         
         # Determine image size based on grid
-        if rows == 4:
-            image_size = 150
-        elif rows == 3:
-            image_size = 180
-        else:  # 2x2 grid
-            image_size = 220
+        image_size = self.challenge.rule.cell_size
         
         # Create a nested frame for the grid
         grid_frame = Frame(self.image_frame, bg="#f0f0f0")
@@ -252,6 +355,8 @@ class VerificationSystem:
         if len(self.current_images) != total_cells:
             print(f"Warning: Expected {total_cells} images for level {self.current_level}, but got {len(self.current_images)}")
         
+        atlas = self.tile_atlases.get(image_size)
+        tiles = []
         for i in range(total_cells):
             frame = Frame(
                 grid_frame,
@@ -264,147 +369,209 @@ class VerificationSystem:
             frame.grid_propagate(False)
             
             if i < len(self.current_images):
-                # Determine if this is a campus image
-                image_name = self.current_images[i]
-                is_campus = image_name in self.all_campus_images
+                image_id = self.current_images[i]
+                img_path = self.current_records[image_id].path
                 
-                # Load the actual image
-                if is_campus:
-                    img_path = os.path.join(self.campus_images_path, image_name)
-                else:
-                    img_path = os.path.join(self.external_images_path, image_name)
+                # Placeholder shown until the background loader delivers the tile
+                img_label = tk.Label(frame, text="Loading...", bg="#e0e0e0")
+                img_label.pack(fill=tk.BOTH, expand=True)
+                
+                # Store image info
+                img_label.image_id = image_id
+                img_label.image_size = image_size
+                
+                self.image_buttons[image_id] = img_label
                 
-                try:
-                    # Load and resize the image
-                    pil_img = Image.open(img_path)
-                    pil_img = pil_img.resize((image_size-4, image_size-4), Image.LANCZOS)
-                    tk_img = ImageTk.PhotoImage(pil_img)
-                    
-                    # Create a label to display the image
-                    img_label = tk.Label(frame, image=tk_img)
-                    img_label.image = tk_img  # Keep a reference to prevent garbage collection
-                    img_label.pack(fill=tk.BOTH, expand=True)
-                    
-                    # Store image info and selection state
-                    img_label.is_selected = False
-                    img_label.is_campus = is_campus
-                    img_label.image_index = i
-                    
-                    # Bind click event
-                    img_label.bind("<Button-1>", self.toggle_selection)
-                    
-                    self.image_buttons.append(img_label)
-                except Exception as e:
-                    # Handle image loading errors
-                    print(f"Error loading image {img_path}: {e}")
-                    # Create a fallback colored rectangle
-                    color = "#a3c4bc" if is_campus else "#e6a57e"
-                    canvas = tk.Canvas(frame, width=image_size-4, height=image_size-4, bg=color)
-                    canvas.pack(fill=tk.BOTH, expand=True)
-                    
-                    # Add text label with filename
-                    canvas.create_text(
-                        image_size//2, 
-                        image_size//2, 
-                        text=image_name,
-                        font=("Arial", 10),
-                        fill="#000000",
-                        width=image_size-20  # Wrap text if filename is long
-                    )
-                    
-                    canvas.is_selected = False
-                    canvas.is_campus = is_campus
-                    canvas.image_index = i
-                    canvas.bind("<Button-1>", self.toggle_selection)
-                    self.image_buttons.append(canvas)
+                # Atlas tiles are shown straight from the mapped file; the rest are decoded
+                atlas_img = atlas.image(image_id, self.current_records[image_id].mtime_ns) if atlas else None
+                if atlas_img is not None:
+                    self.show_tile(image_id, atlas_img, None)
+                else:
+                    tiles.append((image_id, img_path, image_size))
             else:
                 # If we don't have enough images, create an empty cell
                 # This should not happen if our image counts are correct
                 print(f"Warning: Not enough images for cell {i} in {rows}x{cols} grid")
                 empty_label = tk.Label(frame, text="No Image", bg="#f0f0f0")
                 empty_label.pack(fill=tk.BOTH, expand=True)
+        
+        # Decode tiles off the main thread; the level timer starts once the grid is complete
+        self.image_loader.load_grid(tiles, self.show_tile, self.grid_ready)
+    
+    def show_tile(self, image_id, pil_img, error):
+        """Fill a grid cell with its decoded image (called on the main thread)"""
+        placeholder = self.image_buttons[image_id]
+        
+        if error is None:
+            from PIL import ImageTk
+            
+            tk_img = ImageTk.PhotoImage(pil_img)
+            placeholder.config(image=tk_img, text="", bg="#f0f0f0")
+            placeholder.image = tk_img  # Keep a reference to prevent garbage collection
+            
+            # Bind click event
+            placeholder.bind("<Button-1>", self.toggle_selection)
+            return
+        
+        # Handle image loading errors
+        record = self.current_records[image_id]
+        print(f"Error loading image {record.path}: {error}")
+        image_size = placeholder.image_size
+        frame = placeholder.master
+        placeholder.destroy()
+        
+        # Create a fallback colored rectangle
+        color = "#a3c4bc" if record.is_campus else "#e6a57e"
+        canvas = tk.Canvas(frame, width=image_size-4, height=image_size-4, bg=color)
+        canvas.pack(fill=tk.BOTH, expand=True)
+        
+        # Add text label with filename
+        canvas.create_text(
+            image_size//2, 
+            image_size//2, 
+            text=record.name,
+            font=("Arial", 10),
+            fill="#000000",
+            width=image_size-20  # Wrap text if filename is long
+        )
+        
+        canvas.image_id = image_id
+        canvas.bind("<Button-1>", self.toggle_selection)
+        self.image_buttons[image_id] = canvas
+    
+    def grid_ready(self):
+        """Start the level timer once every tile of the grid is on screen"""
+        self.grid_shown_at = time.perf_counter()
+        metrics.observe("grid_render_seconds", self.grid_shown_at - self.grid_started_at,
+                        level=self.current_level)
+        if self.startup_started_at is not None:
+            # Time from constructing the kiosk to its first playable grid
+            metrics.observe("startup_seconds", self.grid_shown_at - self.startup_started_at)
+            self.startup_started_at = None
+        self.start_timer()
+        
+        # Decode the next level and a fresh level 1 (for a reset) while the user works
+        if self.current_level < self.engine.level_count:
+            self.prefetch_level(self.current_level + 1)
+        self.prefetch_level(1)
     
     def toggle_selection(self, event):
         """Toggle the selection state of an image"""
         widget = event.widget
         
-        # For level 1, deselect all other images first
-        if self.current_level == 1:
-            for button in self.image_buttons:
-                if button != widget:
-                    if isinstance(button, tk.Label):
-                        button.config(bd=0)
-                    else:  # It's a Canvas
-                        button.config(highlightthickness=0)
-                    button.is_selected = False
-                    if button.image_index in self.selected_images:
-                        self.selected_images.remove(button.image_index)
-        
-        if widget.is_selected:
-            # Deselect
-            if isinstance(widget, tk.Label):
-                widget.config(bd=0)
-            else:  # It's a Canvas
-                widget.config(highlightthickness=0)
-            widget.is_selected = False
-            if widget.image_index in self.selected_images:
-                self.selected_images.remove(widget.image_index)
-        else:
-            # Select
-            if isinstance(widget, tk.Label):
-                widget.config(bd=3, borderwidth=3, relief=tk.SOLID)
-            else:  # It's a Canvas
-                widget.config(highlightthickness=3, highlightbackground="#007bff")
-            widget.is_selected = True
-            if widget.image_index not in self.selected_images:
-                self.selected_images.append(widget.image_index)
+        if not self.first_click_seen and self.grid_shown_at is not None:
+            self.first_click_seen = True
+            metrics.observe("time_to_first_click_seconds", time.perf_counter() - self.grid_shown_at,
+                            level=self.current_level)
+        
+        # The engine tracks the selection (single-select levels drop the previous pick)
+        previously_selected = set(self.challenge.selected)
+        self.challenge.toggle(widget.image_id)
+        
+        # Repaint only the tiles whose state changed
+        for image_id in previously_selected ^ self.challenge.selected:
+            button = self.image_buttons[image_id]
+            if image_id in self.challenge.selected:
+                # Select
+                if isinstance(button, tk.Label):
+                    button.config(bd=3, borderwidth=3, relief=tk.SOLID)
+                else:  # It's a Canvas
+                    button.config(highlightthickness=3, highlightbackground="#007bff")
+            else:
+                # Deselect
+                if isinstance(button, tk.Label):
+                    button.config(bd=0)
+                else:  # It's a Canvas
+                    button.config(highlightthickness=0)
         
         # Enable/disable submit button based on selection count
-        if len(self.selected_images) > 0:
+        if len(self.challenge.selected) > 0:
             self.submit_button.config(state=tk.NORMAL)
         else:
             self.submit_button.config(state=tk.DISABLED)
     
-    def _get_required_selection_count(self):
-        """Get the required number of selections for the current level"""
-        if self.current_level == 1:  # Original level 3
-            return 1  # Level 1: select 1 campus image
-        elif self.current_level == 2:  # Original level 2 (modified)
-            return 3  # Level 2: select 3 campus images (changed from 4)
-        else:  # Level 3 (original level 1)
-            return 6  # Level 3: select 6 campus images
+    def export_metrics(self):
+        """Publish cache statistics and hand the export to a worker thread"""
+        stats = self.tile_memory_cache.stats()
+        metrics.set_gauge("tile_cache_hit_ratio", stats["hit_rate"])
+        metrics.set_gauge("tile_cache_bytes", stats["bytes"])
+        metrics.set_gauge("tile_cache_evictions", stats["evictions"])
+        self.image_loader.executor.submit(metrics.export)
+        self.root.after(self.metrics_export_ms, self.export_metrics)
+    
+    def catalog_changed(self, added_ids, removed_ids, modified_ids):
+        """Handle images added to, removed from or modified in the image directories (watcher thread)"""
+        print(f"Image catalog updated: {len(added_ids)} added, {len(removed_ids)} removed, "
+              f"{len(modified_ids)} modified")
+        records = self.catalog.records
+        # Modified images need new thumbnails and atlas tiles just like new ones
+        changed_paths = [records[image_id].path for image_id in added_ids + modified_ids if image_id in records]
+        if changed_paths and not self.shared_cache:
+            self.image_loader.executor.submit(self.refresh_tiles, changed_paths)
+        self.image_loader.executor.submit(self.refresh_duplicates)
+    
+    def refresh_duplicates(self):
+        """Regroup near-duplicates, then refill the challenge pools with them in mind (worker thread)"""
+        if self.shared_cache:
+            # Use the hashes the launcher saved instead of hashing images again
+            self.duplicate_index.reload()
+            self.duplicate_index.update(hash_missing=False)
+        else:
+            self.duplicate_index.update()
+        self.scheduler.clear()
+        for level in self.engine.levels:
+            if self.engine.can_generate(level):
+                self.scheduler.request_refill(level)
+    
+    def refresh_tiles(self, img_paths):
+        """Build missing thumbnails, then repack stale atlases and map them (worker thread)"""
+        self.thumbnail_cache.build(img_paths)
+        cache_dir = self.thumbnail_cache.cache_dir
+        sizes = self.thumbnail_cache.sizes
+        if build_atlases(self.catalog, cache_dir, sizes, self.thumbnail_cache):
+            # Swapping the whole dict keeps the main thread from seeing a partial update
+            self.tile_atlases = open_atlases(cache_dir, sizes)
+    
+    def watch_shared_cache(self):
+        """Remap the shared atlases after the launcher rebuilt them"""
+        cache_dir = self.thumbnail_cache.cache_dir
+        sizes = self.thumbnail_cache.sizes
+        mtimes = atlas_mtimes(cache_dir, sizes)
+        if mtimes != self.atlas_mtimes:
+            self.atlas_mtimes = mtimes
+            self.tile_atlases = open_atlases(cache_dir, sizes)
+            self.image_loader.executor.submit(self.refresh_duplicates)
+        self.root.after(self.shared_cache_poll_ms, self.watch_shared_cache)
     
     def validate_selection(self):
         """Validate the user's selection"""
-        # Stop the timer
+        # Stop the timer and any tiles still loading for this grid
+        self.image_loader.cancel()
         if self.timer_id:
             self.root.after_cancel(self.timer_id)
             self.timer_id = None
         
-        # Check if all selected images are campus images
-        all_correct = True
-        incorrect_selections = []
-        
-        for idx in self.selected_images:
-            widget = self.image_buttons[idx]
-            if not widget.is_campus:
-                all_correct = False
-                incorrect_selections.append(idx)
+        # Check that exactly the campus images were selected, before the deadline
+        result = self.engine.validate(self.challenge)
+        if result.expired:
+            self.time_expired()
+            return
         
-        # Check if we selected all required campus images
-        required_campus_count = self._get_required_selection_count()
-        selected_campus_images = [idx for idx in self.selected_images if self.image_buttons[idx].is_campus]
-        campus_count = len(selected_campus_images)
+        if self.grid_shown_at is not None:
+            metrics.observe("time_to_submit_seconds", time.perf_counter() - self.grid_shown_at,
+                            level=self.current_level)
+        metrics.inc("verifications_total", level=self.current_level,
+                    outcome="pass" if result.passed else "fail")
         
         # Calculate points for this level
-        level_points = campus_count * self.points_per_correct
+        level_points = result.points
         
         # Add to total points
         self.total_points += level_points
         self.points_label.config(text=f"Total Points: {self.total_points}")
         
-        if all_correct and campus_count == required_campus_count:
-            if self.current_level < 3:
+        if result.passed:
+            if self.current_level < self.engine.level_count:
                 messagebox.showinfo("Success", f"Level {self.current_level} completed successfully!\nYou earned {level_points} points!\nProceeding to Level {self.current_level + 1}.")
                 self.current_level += 1
                 self.load_level()
@@ -414,8 +581,8 @@ class VerificationSystem:
                 self.root.after(1500, self.reset_verification)
         else:
             # Highlight incorrect selections in red
-            for idx in incorrect_selections:
-                widget = self.image_buttons[idx]
+            for image_id in result.incorrect:
+                widget = self.image_buttons[image_id]
                 if isinstance(widget, tk.Label):
                     widget.config(bd=3, borderwidth=3, relief=tk.SOLID, highlightbackground="#ff0000", highlightthickness=3)
                 else:  # It's a Canvas
@@ -434,20 +601,35 @@ class VerificationSystem:
     
     def start_timer(self):
         """Start the countdown timer for the current level"""
-        if self.time_remaining > 0:
-            self.timer_id = self.root.after(1000, self.update_timer)
-        else:
-            self.time_expired()
+        # Fix the deadline now; stalls in the main loop can no longer add time
+        self.challenge.start()
+        self.update_timer()
     
     def update_timer(self):
-        """Update the timer countdown"""
-        self.time_remaining -= 1
-        self.update_timer_display()
-        
-        if self.time_remaining <= 0:
+        """Update the timer countdown from the challenge deadline"""
+        self.timer_id = None
+        remaining = self.challenge.time_remaining()
+        if remaining <= 0:
+            self.time_remaining = 0
+            self.update_timer_display()
             self.time_expired()
-        else:
-            self.timer_id = self.root.after(1000, self.update_timer)
+            return
+        
+        # Repaint only when the shown (rounded up) second changes
+        shown = math.ceil(remaining)
+        if shown != self.time_remaining:
+            self.time_remaining = shown
+            self.update_timer_display()
+        
+        # Wake up right when the shown second next changes; with a repaint interval over
+        # a second, that many whole seconds later (rounded up). Each wake is aimed
+        # at a boundary of the deadline, so late callbacks never add up. Never wake later
+        # than the deadline itself
+        until_next_second = remaining - (shown - 1)
+        repaint_s = self.timer_repaint_ms / 1000
+        delay = until_next_second + max(0, math.ceil(repaint_s) - 1)
+        delay = min(delay, remaining)
+        self.timer_id = self.root.after(max(1, math.ceil(delay * 1000)), self.update_timer)
     
     def update_timer_display(self):
         """Update the timer display label"""
@@ -456,7 +638,7 @@ class VerificationSystem:
         self.timer_label.config(text=f"Time: {minutes:02d}:{seconds:02d}")
         
         # Change color to red when time is running out (less than 20% of time remaining)
-        time_limit = self.time_limits[self.current_level]
+        time_limit = self.engine.rule(self.current_level).time_limit
         if self.time_remaining < time_limit * 0.2:
             self.timer_label.config(fg="#ff0000")  # Bright red
         else:
@@ -468,44 +650,31 @@ class VerificationSystem:
             self.root.after_cancel(self.timer_id)
             self.timer_id = None
         
+        metrics.inc("verifications_total", level=self.current_level, outcome="timeout")
+        
         messagebox.showwarning("Time Expired", f"Time's up! You didn't complete Level {self.current_level} in time.\nYour final score: {self.total_points} points.")
         self.reset_verification()
-    
-    def simulate_bot_attack(self):
-        """
-        A method to demonstrate how the system would perform against a simulated bot attack.
-        In a real implementation, this would be separate and used for testing only.
-        """
-        # Calculate theoretical success probabilities
-        # Level 1: Select exactly 1 campus image from 4 total (1 campus, 3 external)
-        level1_prob = 1/4  # This would be 1/4
-        
-        # Level 2: Select exactly 3 campus images from 9 total (3 campus, 6 external)
-        level2_prob = 1/binom(9, 3)  # This would be C(3,3)/C(9,3)
-        
-        # Level 3: Select exactly 6 campus images from
-        # 16 total (6 campus, 10 external)
-        level3_prob = 1/binom(16, 6)  # This would be C(6,6)/C(16,6)
-        
-        # Combined probability (all three levels must be passed)
-        combined_prob = level1_prob * level2_prob * level3_prob
-        
-        print(f"Theoretical bot success probability:")
-        print(f"Level 1: {level1_prob:.10f}")
-        print(f"Level 2: {level2_prob:.10f}")
-        print(f"Level 3: {level3_prob:.10f}")
-        print(f"Overall: {combined_prob:.15f}")
 
-def binom(n, k):
-    """Calculate the binomial coefficient C(n,k)"""
-    from math import factorial
-    return factorial(n) // (factorial(k) * factorial(n - k))
-
-def main():
+def main(image_roots=None, cache_dir=DEFAULT_CACHE_DIR, shared_cache=False):
     """Main function to start the application"""
+    # Metrics stay off unless an export sink is configured in the environment
+    configure_from_env()
     root = tk.Tk()
-    app = VerificationSystem(root)
+    app = VerificationSystem(root, image_roots, cache_dir, shared_cache)
     root.mainloop()
+    if app.catalog_watcher is not None:
+        app.catalog_watcher.stop()
+    app.image_loader.shutdown()
+    metrics.export()
+
+def parse_args():
+    """Read the image directories and cache location from the command line"""
+    parser = argparse.ArgumentParser(description="Run the campus verification kiosk")
+    parser.add_argument("--campus-dir", default=os.path.join(BASE_DIR, "campus_images"))
+    parser.add_argument("--external-dir", default=os.path.join(BASE_DIR, "external_images"))
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = parse_args()
+    main({CAMPUS: args.campus_dir, EXTERNAL: args.external_dir}, args.cache_dir)
\ No newline at end of file
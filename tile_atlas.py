@@ -0,0 +1,232 @@
+"""
+Memory-mapped tile atlas.
+
+One file per grid cell size holds every tile as raw RGBX pixels at a fixed offset, with
+a JSON index (image ID -> slot) at the end of the file. Readers mmap the file, so a tile
+needs no file open and no decode. Pillow maps 4-byte modes such as RGBX in place (RGB
+would be copied), so Image.frombuffer wraps the mapped bytes without copying them; the
+only copy left is the one into the Tk photo. Kiosk processes on the same host share the
+pages through the page cache.
+
+File layout:
+    header   magic, dim, tile count, index offset, index length (ATLAS_HEADER)
+    tiles    tile i at DATA_OFFSET + i * dim * dim * 4
+    index    JSON {"cell_size", "dim", "tiles": {image_id: [slot, path, mtime_ns]},
+                   "failed": {image_id: [path, mtime_ns]}}
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+
+from image_cache import CELL_SIZES, DEFAULT_CACHE_DIR, ThumbnailCache, thumbnail_dimension
+from metrics import metrics
+
+# Bumped with the file layout; older atlases are rebuilt
+ATLAS_MAGIC = b"TILEATL2"
+ATLAS_HEADER = struct.Struct("<8sIIQQ")
+
+# Tiles start on a page boundary
+DATA_OFFSET = mmap.PAGESIZE
+
+
+def atlas_path(cache_dir, cell_size):
+    """Return the atlas file for a cell size"""
+    return os.path.join(cache_dir, f"atlas_{cell_size}.bin")
+
+
+def read_index(path):
+    """Return the index of an atlas file, or None when it is missing or unreadable"""
+    try:
+        with open(path, "rb") as f:
+            magic, _, _, index_offset, index_length = ATLAS_HEADER.unpack(f.read(ATLAS_HEADER.size))
+            if magic != ATLAS_MAGIC:
+                return None
+            f.seek(index_offset)
+            return json.loads(f.read(index_length))
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+def source_mtimes(records):
+    """
+    Stat the source file of every record: image ID -> mtime_ns (None when it is gone).
+    Files edited in place keep their catalog record until the next refresh, so tile
+    freshness is always judged against the file on disk.
+    """
+    mtimes = {}
+    for image_id, record in records.items():
+        try:
+            mtimes[image_id] = os.stat(record.path).st_mtime_ns
+        except OSError:
+            mtimes[image_id] = None
+    return mtimes
+
+
+def is_current(index, records, mtimes=None):
+    """Whether an atlas index holds an up-to-date tile for every catalog record"""
+    if index is None:
+        return False
+    if mtimes is None:
+        mtimes = source_mtimes(records)
+    tiles = index["tiles"]
+    # Sources that could not be rendered count as current until they change, so one
+    # broken file does not rebuild every atlas on each call
+    failed = index.get("failed", {})
+    for image_id, record in records.items():
+        mtime_ns = mtimes.get(image_id)
+        if mtime_ns is None:
+            # Deleted; the catalog drops it on its next refresh
+            continue
+        entry = tiles.get(image_id)
+        if entry is not None:
+            entry = entry[1:]
+        else:
+            entry = failed.get(image_id)
+        if entry is None or entry[0] != record.path or entry[1] != mtime_ns:
+            return False
+    return True
+
+
+def build_atlas(records, cell_size, cache_dir=DEFAULT_CACHE_DIR, thumbnail_cache=None, mtimes=None):
+    """
+    Write the atlas for one cell size from the thumbnail cache.
+    records maps image ID to ImageRecord; returns the atlas path.
+    """
+    from PIL import Image
+
+    thumbnail_cache = thumbnail_cache or ThumbnailCache(cache_dir)
+    # Stat before reading the thumbnails: a source modified in between gets a tile
+    # stamped with the older mtime, which the next is_current() check rebuilds
+    if mtimes is None:
+        mtimes = source_mtimes(records)
+    dim = thumbnail_dimension(cell_size)
+    path = atlas_path(cache_dir, cell_size)
+    tiles = {}
+    failed = {}
+
+    # Write to a temp file first; readers that still map the old atlas keep their pages
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.seek(DATA_OFFSET)
+        for image_id, record in sorted(records.items()):
+            mtime_ns = mtimes.get(image_id)
+            if mtime_ns is None:
+                continue
+            try:
+                with Image.open(thumbnail_cache.get(record.path, cell_size)) as tile:
+                    tile = tile.convert("RGB")
+                if tile.size != (dim, dim):
+                    tile = tile.resize((dim, dim), Image.LANCZOS)
+            except Exception as e:
+                print(f"Error adding {record.path} to the tile atlas: {e}")
+                failed[image_id] = [record.path, mtime_ns]
+                continue
+            f.write(tile.convert("RGBX").tobytes())
+            tiles[image_id] = [len(tiles), record.path, mtime_ns]
+
+        index = json.dumps({"cell_size": cell_size, "dim": dim, "tiles": tiles,
+                            "failed": failed}).encode("utf-8")
+        index_offset = f.tell()
+        f.write(index)
+        f.seek(0)
+        f.write(ATLAS_HEADER.pack(ATLAS_MAGIC, dim, len(tiles), index_offset, len(index)))
+    os.replace(tmp_path, path)
+    return path
+
+
+def build_atlases(catalog, cache_dir=DEFAULT_CACHE_DIR, sizes=CELL_SIZES, thumbnail_cache=None):
+    """Rebuild the atlas of every cell size that is missing or out of date; returns the rebuilt sizes"""
+    records = catalog.records
+    mtimes = source_mtimes(records)
+    rebuilt = []
+    for cell_size in sizes:
+        if not is_current(read_index(atlas_path(cache_dir, cell_size)), records, mtimes):
+            build_atlas(records, cell_size, cache_dir, thumbnail_cache, mtimes)
+            rebuilt.append(cell_size)
+    return rebuilt
+
+
+class TileAtlas:
+    """Read-only, memory-mapped view of one atlas file"""
+
+    def __init__(self, path):
+        """Map the atlas at path (raises OSError/ValueError when it is missing or invalid)"""
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.dim, count, index_offset, index_length = ATLAS_HEADER.unpack_from(self._map)
+        if magic != ATLAS_MAGIC:
+            self._map.close()
+            raise ValueError(f"{path} is not a tile atlas")
+        index = json.loads(self._map[index_offset:index_offset + index_length])
+        self.cell_size = index["cell_size"]
+        self.tile_bytes = self.dim * self.dim * 4
+        self._tiles = index["tiles"]
+        self._view = memoryview(self._map)
+
+    @classmethod
+    def open(cls, cache_dir, cell_size):
+        """Return the atlas of a cell size, or None when none has been built"""
+        try:
+            return cls(atlas_path(cache_dir, cell_size))
+        except (OSError, ValueError, struct.error):
+            return None
+
+    def __contains__(self, image_id):
+        return image_id in self._tiles
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def tile_view(self, image_id, mtime_ns=None):
+        """
+        Return a memoryview of the tile's raw RGBX pixels, or None when the atlas has
+        no tile for the image (or only one of an older version, if mtime_ns is given).
+        """
+        entry = self._tiles.get(image_id)
+        if entry is None or (mtime_ns is not None and entry[2] != mtime_ns):
+            metrics.inc("tile_atlas_lookups_total", result="miss")
+            return None
+        metrics.inc("tile_atlas_lookups_total", result="hit")
+        start = DATA_OFFSET + entry[0] * self.tile_bytes
+        return self._view[start:start + self.tile_bytes]
+
+    def image(self, image_id, mtime_ns=None):
+        """Return the tile as a PIL image sharing the mapped memory, or None"""
+        from PIL import Image
+
+        view = self.tile_view(image_id, mtime_ns)
+        if view is None:
+            return None
+        return Image.frombuffer("RGBX", (self.dim, self.dim), view, "raw", "RGBX", 0, 1)
+
+    def close(self):
+        """Unmap the file; left to garbage collection while tile images still reference it"""
+        try:
+            self._view.release()
+            self._map.close()
+        except BufferError:
+            pass
+
+
+def atlas_mtimes(cache_dir=DEFAULT_CACHE_DIR, sizes=CELL_SIZES):
+    """Return the mtime of every atlas file (None when missing), to notice rebuilds"""
+    mtimes = []
+    for cell_size in sizes:
+        try:
+            mtimes.append(os.stat(atlas_path(cache_dir, cell_size)).st_mtime_ns)
+        except OSError:
+            mtimes.append(None)
+    return tuple(mtimes)
+
+
+def open_atlases(cache_dir=DEFAULT_CACHE_DIR, sizes=CELL_SIZES):
+    """Map the atlases that exist, keyed by cell size"""
+    atlases = {}
+    for cell_size in sizes:
+        atlas = TileAtlas.open(cache_dir, cell_size)
+        if atlas is not None:
+            atlases[cell_size] = atlas
+    return atlases